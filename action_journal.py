@@ -0,0 +1,76 @@
+import json
+import os
+import threading
+
+
+class ActionJournal:
+    """
+    Persists multi-step reddit action chains (remove -> reply -> distinguish -> lock -> ignore reports) so a chain
+    interrupted by a restart can be finished on the next startup instead of leaving e.g. an unpinned SS, or a
+    removed post without its removal reason.
+    Removal chains are keyed by the removed content's fullname and hold the pending reply, reply chains by the
+    reply comment's id.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.entries = self.load()
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return dict()
+        try:
+            with open(self.path) as journal_file:
+                return json.load(journal_file)
+        except (OSError, ValueError) as e:
+            print(f"Could not read action journal {self.path}, starting empty: {e}")
+            return dict()
+
+    def save(self):
+        temp_path = self.path + ".tmp"
+        with open(temp_path, "w") as journal_file:
+            json.dump(self.entries, journal_file)
+        os.replace(temp_path, self.path)
+
+    def begin_removal_chain(self, fullname, mod_note, reply, pin, lock, ignore_reports):
+        with self.lock:
+            self.entries[fullname] = {
+                "mod_note": mod_note,
+                "reply": reply,
+                "pin": pin,
+                "lock": lock,
+                "ignore_reports": ignore_reports,
+                "completed": [],
+            }
+            self.save()
+
+    def begin_reply_chain(self, comment_id, pin, lock, ignore_reports, replaces=None):
+        # replaces is the removal chain the reply continues, swapped out in the same save
+        with self.lock:
+            if replaces is not None:
+                self.entries.pop(replaces, None)
+            self.entries[comment_id] = {
+                "pin": pin,
+                "lock": lock,
+                "ignore_reports": ignore_reports,
+                "completed": [],
+            }
+            self.save()
+
+    def complete_step(self, comment_id, step):
+        with self.lock:
+            entry = self.entries.get(comment_id)
+            if entry is None:
+                return
+            entry["completed"].append(step)
+            self.save()
+
+    def finish(self, comment_id):
+        with self.lock:
+            if self.entries.pop(comment_id, None) is not None:
+                self.save()
+
+    def pending(self):
+        with self.lock:
+            return {comment_id: dict(entry) for comment_id, entry in self.entries.items()}
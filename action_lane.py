@@ -0,0 +1,25 @@
+from enum import IntEnum
+
+
+class ActionLane(IntEnum):
+    # lower value = higher priority
+    DEADLINE = 0  # removals, reports and pins once the ss time limit has expired
+    REMINDER = 1  # too short/final reminders
+    ON_TOPIC = 2  # on-topic replies, ss edits
+    MAINTENANCE = 3  # stale post reports, bot comment cleanups
+
+
+class LaneStats:
+    def __init__(self):
+        self.count = 0
+        self.total_wait_secs = 0.0
+        self.max_wait_secs = 0.0
+
+    def record(self, wait_secs):
+        self.count += 1
+        self.total_wait_secs += wait_secs
+        self.max_wait_secs = max(self.max_wait_secs, wait_secs)
+
+    def __str__(self):
+        average = self.total_wait_secs / self.count if self.count else 0
+        return f"{self.count} actions, queue wait avg {average:.1f}s max {self.max_wait_secs:.1f}s"
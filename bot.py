@@ -1,17 +1,38 @@
+import time
+
+# startup is measured from here to the first sweep
+boot_time = time.time()
+
+import threading
 import traceback
+from datetime import datetime
 from threading import Thread
 
 import config
 import os
 import praw
 
-from discord_client import DiscordClient
+from action_journal import ActionJournal
+from discord_reporter import DiscordReporter
 from janitor import Janitor
+from lazy_fetch_audit import LazyFetchAudit
+from profiler import SweepProfiler
 from reddit_actions_handler import RedditActionsHandler
+from session_stats import SessionStats
 from settings import *
-import time
+from shutdown import ShutdownCoordinator
 
 from subreddit_tracker import SubredditTracker
+from tracker_checkpoint import TrackerCheckpoint
+
+
+def run_discord(token, error_guild_name, error_channel_name, profiler, reporter):
+    # discord is imported here so its import and gateway connection stay off the reddit startup path
+    from discord_client import DiscordClient
+    discord_client = DiscordClient(error_guild_name, error_channel_name, profiler, reporter)
+    discord_client.add_commands()
+    discord_client.run(token)
+
 
 if __name__ == "__main__":
     # get config from env vars if set, otherwise from config file
@@ -23,53 +44,154 @@ if __name__ == "__main__":
     discord_error_guild_name = os.environ.get("DISCORD_ERROR_GUILD", config.DISCORD_ERROR_GUILD)
     discord_error_channel_name = os.environ.get("DISCORD_ERROR_CHANNEL", config.DISCORD_ERROR_CHANNEL)
     subreddits_config = os.environ.get("SUBREDDITS", config.SUBREDDITS)
+    state_dir = os.environ.get("STATE_DIR", config.STATE_DIR)
+    settings_wiki_page = os.environ.get("SETTINGS_WIKI_PAGE", config.SETTINGS_WIKI_PAGE)
+    settings_override_file = os.environ.get("SETTINGS_OVERRIDE_FILE", config.SETTINGS_OVERRIDE_FILE)
+    strict_lazy_fetch = str(os.environ.get("STRICT_LAZY_FETCH", config.STRICT_LAZY_FETCH)).lower() in ("1", "true")
     subreddit_names = [subreddit.strip() for subreddit in subreddits_config.split(",")]
     print("CONFIG: subreddit_names=" + str(subreddit_names) + ", client_id=" + client_id)
 
-    discord_client = DiscordClient(discord_error_guild_name, discord_error_channel_name)
-    discord_client.add_commands()
-    Thread(target=discord_client.run, args=(discord_token,)).start()
+    LazyFetchAudit.install(strict_lazy_fetch)
+    shutdown = ShutdownCoordinator(Settings.shutdown_drain_budget_secs)
+    shutdown.install_signal_handlers()
+    journal = ActionJournal(os.path.join(state_dir, "action_journal.json"))
+    checkpoint = TrackerCheckpoint(os.path.join(state_dir, "tracker_checkpoint.json"))
+
+    # this (main) thread is the reddit worker
+    profiler = SweepProfiler(threading.get_ident(), state_dir)
+    # reddit work starts immediately, messages are buffered until discord is ready
+    discord_reporter = DiscordReporter()
+    # daemon, so the discord thread doesn't keep the process alive after shutdown
+    Thread(target=run_discord, args=(discord_token, discord_error_guild_name, discord_error_channel_name,
+                                     profiler, discord_reporter), daemon=True).start()
 
-    while not discord_client.is_ready:
-        time.sleep(1)
+    def create_reddit():
+        return praw.Reddit(
+            client_id=client_id,
+            client_secret=client_secret,
+            user_agent="flyio:com.statementbot.statement-bot:v3.1",
+            redirect_uri="http://localhost:8080",  # unused for script applications
+            username=bot_username,
+            password=bot_password
+        )
 
-    while True:
+    # the reddit client, handler (throttle state) and trackers (monitoring state) are long-lived,
+    # a failing subreddit is skipped by its breaker and drops its cached state, the client is only rebuilt
+    # when every subreddit fails
+    reddit = create_reddit()
+    session_stats = SessionStats()
+    reddit_handler = RedditActionsHandler(reddit, discord_reporter, journal, shutdown)
+    reddit_handler.resume_journaled_actions()
+
+    subreddit_trackers = list()
+    for subreddit_name in subreddit_names:
+        settings = SettingsFactory.get_settings(subreddit_name)
+        print(f"Creating Subreddit: {subreddit_name} with {type(settings).__name__} settings")
+        subreddit = reddit.subreddit(subreddit_name)
+        settings_reloader = None
+        if settings_override_file:
+            source = FileSettingsSource(settings_override_file.format(subreddit=subreddit_name.lower()))
+            settings_reloader = SettingsReloader(subreddit_name, source, discord_reporter)
+        elif settings_wiki_page:
+            source = WikiSettingsSource(subreddit, settings_wiki_page)
+            settings_reloader = SettingsReloader(subreddit_name, source, discord_reporter)
+        subreddit_tracker = SubredditTracker(subreddit, settings, settings_reloader)
+        checkpoint.restore(subreddit_tracker)
+        subreddit_trackers.append(subreddit_tracker)
+
+    janitor = Janitor(discord_reporter, bot_username, reddit, reddit_handler, shutdown)
+
+    first_sweep_done = False
+    failed_sweeps = 0
+    while not shutdown.is_requested():
         try:
-            reddit = praw.Reddit(
-                client_id=client_id,
-                client_secret=client_secret,
-                user_agent="flyio:com.statementbot.statement-bot:v3.1",
-                redirect_uri="http://localhost:8080",  # unused for script applications
-                username=bot_username,
-                password=bot_password
-            )
-
-            reddit_handler = RedditActionsHandler(reddit, discord_client)
-
-            subreddit_trackers = list()
-            for subreddit_name in subreddit_names:
-                settings = SettingsFactory.get_settings(subreddit_name)
-                print(f"Creating Subreddit: {subreddit_name} with {type(settings).__name__} settings")
-                subreddit = reddit.subreddit(subreddit_name)
-                subreddit_tracker = SubredditTracker(subreddit, settings)
-                subreddit_trackers.append(subreddit_tracker)
-
-            janitor = Janitor(discord_client, bot_username, reddit, reddit_handler)
-            while True:
+            if not first_sweep_done:
+                print(f"Startup: first sweep started {time.time() - boot_time:.2f}s after boot")
+            active_trackers = list()
+            for subreddit_tracker in subreddit_trackers:
+                if not subreddit_tracker.breaker.allow_request():
+                    print(f"Skipping Subreddit: {subreddit_tracker.subreddit_name}, circuit open")
+                    continue
+                subreddit_tracker.reload_settings()
+                active_trackers.append(subreddit_tracker)
+
+            # one listing request for all subreddits, instead of one per subreddit
+            new_posts = dict()
+            stale_unmoderated_posts = dict()
+            now = datetime.utcnow()
+            combined_trackers = [subreddit_tracker for subreddit_tracker in active_trackers
+                                 if subreddit_tracker.combined_listing_retry_time <= now]
+            if Settings.combined_listings and len(combined_trackers) > 1:
+                try:
+                    new_posts = janitor.fetch_combined_new_posts(combined_trackers)
+                    due_trackers = [subreddit_tracker for subreddit_tracker in active_trackers
+                                    if subreddit_tracker.combined_unmoderated_retry_time <= now and
+                                    janitor.is_stale_unmoderated_check_due(subreddit_tracker, now)]
+                    if len(due_trackers) > 1:
+                        stale_unmoderated_posts = janitor.fetch_combined_stale_unmoderated_posts(due_trackers)
+                except Exception as e:
+                    message = f"Exception fetching combined listings, falling back to separate listings: {e}\n" \
+                              f"```{traceback.format_exc()}```"
+                    discord_reporter.send_error_msg(message)
+                    print(message)
+
+            attempted = 0
+            failed = 0
+            for subreddit_tracker in active_trackers:
+                if shutdown.is_requested():
+                    break
+                attempted += 1
+                try:
+                    print("____________________")
+                    print(f"Checking Subreddit: {subreddit_tracker.subreddit_name}")
+                    janitor.handle_posts(subreddit_tracker, new_posts.get(subreddit_tracker.subreddit_name))
+                    janitor.handle_stale_unmoderated_posts(
+                        subreddit_tracker, stale_unmoderated_posts.get(subreddit_tracker.subreddit_name))
+                    janitor.handle_monitored_ss_replies(subreddit_tracker)
+                    subreddit_tracker.cache.release_loaded()
+                    print(subreddit_tracker.cache)
+                    subreddit_tracker.breaker.record_success()
+                except Exception as e:
+                    failed += 1
+                    message = f"Exception when handling all posts: {e}\n```{traceback.format_exc()}```"
+                    discord_reporter.send_error_msg(message)
+                    print(message)
+                    if subreddit_tracker.breaker.record_failure():
+                        subreddit_tracker.reset_cached_state()
+
+            # maintenance runs once every subreddit's time critical work is done, so it can't delay the next
+            # subreddit's removals and pins
+            reddit_handler.flush_deferred_actions()
+
+            # every subreddit failing points at the client/session rather than a subreddit
+            failed_sweeps = failed_sweeps + 1 if attempted and failed == attempted else 0
+            if failed_sweeps >= Settings.client_failure_threshold:
+                print(f"All subreddits failed for {failed_sweeps} sweeps, rebuilding reddit client")
+                failed_sweeps = 0
+                session_stats.update(reddit)
+                reddit = create_reddit()
+                session_stats.client_rebuilt()
+                reddit_handler.reddit = reddit
+                janitor.reddit = reddit
                 for subreddit_tracker in subreddit_trackers:
-                    try:
-                        print("____________________")
-                        print(f"Checking Subreddit: {subreddit_tracker.subreddit_name}")
-                        janitor.handle_posts(subreddit_tracker)
-                        janitor.handle_stale_unmoderated_posts(subreddit_tracker)
-                        janitor.handle_monitored_ss_replies(subreddit_tracker)
-                    except Exception as e:
-                        message = f"Exception when handling all posts: {e}\n```{traceback.format_exc()}```"
-                        discord_client.send_error_msg(message)
-                        print(message)
-                time.sleep(Settings.post_check_frequency_mins * 60)
+                    subreddit_tracker.rebind(reddit.subreddit(subreddit_tracker.subreddit_name))
+
+            if not first_sweep_done:
+                first_sweep_done = True
+                print(f"Startup: first sweep completed {time.time() - boot_time:.2f}s after boot")
+            session_stats.update(reddit)
+            print(session_stats)
+            print(reddit_handler.lane_stats_summary())
+            print(LazyFetchAudit.report_and_reset())
+            checkpoint.save(subreddit_trackers)
+            profiler.on_sweep_complete()
         except Exception as e:
             message = f"Exception in main processing: {e}\n```{traceback.format_exc()}```"
-            discord_client.send_error_msg(message)
+            discord_reporter.send_error_msg(message)
             print(message)
-            time.sleep(Settings.post_check_frequency_mins * 60)
+        shutdown.wait(Settings.post_check_frequency_mins * 60)
+
+    # drain deferred maintenance within what's left of the shutdown budget, before checkpointing
+    reddit_handler.run_deferred_actions()
+    checkpoint.save(subreddit_trackers)
+    print(f"Shutdown complete, pending journaled actions: {len(journal.pending())}")
@@ -0,0 +1,43 @@
+import time
+
+
+class CircuitBreaker:
+    """
+    Skips a failing component after failure_threshold consecutive failures, then lets a single trial through
+    after reset_timeout_secs (half open). A trial success closes the breaker, a trial failure re-opens it.
+    """
+    CLOSED = "CLOSED"
+    OPEN = "OPEN"
+    HALF_OPEN = "HALF_OPEN"
+
+    def __init__(self, name, failure_threshold, reset_timeout_secs):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout_secs = reset_timeout_secs
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self.opened_time = 0
+
+    def allow_request(self):
+        if self.state == self.OPEN:
+            if time.time() - self.opened_time < self.reset_timeout_secs:
+                return False
+            print(f"Circuit {self.name} half open, trying again")
+            self.state = self.HALF_OPEN
+        return True
+
+    def record_success(self):
+        if self.state != self.CLOSED:
+            print(f"Circuit {self.name} closed")
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+
+    def record_failure(self):
+        # returns whether this failure opened the breaker
+        self.consecutive_failures += 1
+        if self.state == self.HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+            self.state = self.OPEN
+            self.opened_time = time.time()
+            print(f"Circuit {self.name} open after {self.consecutive_failures} consecutive failures")
+            return True
+        return False
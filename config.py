@@ -11,3 +11,16 @@ DISCORD_ERROR_CHANNEL = 'SomeDiscordChannel'
 
 # Bot
 SUBREDDITS = 'SomeSubreddit,SomeOtherSubreddit'
+
+# State (action journal, tracker checkpoint) - should be on a persistent volume to survive deploys,
+# fly.toml sets STATE_DIR to its mounted volume
+STATE_DIR = '.'
+
+# Optional per-subreddit settings overrides (json), hot reloaded when the revision changes
+# wiki page name in each subreddit, e.g. 'submissionstatementbot', or blank to disable
+SETTINGS_WIKI_PAGE = ''
+# local file used instead of the wiki when set (offline testing), {subreddit} is replaced by the subreddit name
+SETTINGS_OVERRIDE_FILE = ''
+
+# Raise on any unexpected praw lazy fetch (for tests/local runs), lazy fetches are always counted and logged
+STRICT_LAZY_FETCH = False
@@ -8,8 +8,17 @@ from settings import Settings
 
 
 class DiscordClient(commands.Bot):
-    def __init__(self, error_guild_name, error_guild_channel):
-        super().__init__('#', intents=discord.Intents.all())
+    max_message_chars = 2000
+
+    def __init__(self, error_guild_name, error_guild_channel, profiler=None, reporter=None):
+        # only what's needed to find the error channel and read # commands
+        intents = discord.Intents.none()
+        intents.guilds = True
+        intents.guild_messages = True
+        intents.message_content = True
+        super().__init__('#', intents=intents)
+        self.profiler = profiler
+        self.reporter = reporter
         self.error_guild_name = error_guild_name
         self.error_channel_name = error_guild_channel
         self.error_guild = None
@@ -21,6 +30,9 @@ class DiscordClient(commands.Bot):
         self.error_guild = discord.utils.get(self.guilds, name=self.error_guild_name)
         self.error_channel = discord.utils.get(self.error_guild.channels, name=self.error_channel_name)
         self.is_ready = True
+        # attach before anything which can fail (e.g. the greeting), so errors never stay buffered
+        if self.reporter:
+            self.reporter.attach(self)
         guilds_msg = "\n".join([f"\t{guild.name}" for guild in self.guilds])
         startup_message = f"{self.user} is in the following guilds:\n" \
                           f"{guilds_msg}"
@@ -33,6 +45,19 @@ class DiscordClient(commands.Bot):
         if self.error_channel:
             asyncio.run_coroutine_threadsafe(self.error_channel.send(full_message), self.loop)
 
+    def send_msg(self, message):
+        if not self.error_channel:
+            return
+        # split by line to stay under discord's message limit
+        chunk = ""
+        for line in message.split("\n"):
+            if chunk and len(chunk) + len(line) + 1 > self.max_message_chars:
+                asyncio.run_coroutine_threadsafe(self.error_channel.send(chunk), self.loop)
+                chunk = ""
+            chunk = f"{chunk}\n{line}" if chunk else line[:self.max_message_chars]
+        if chunk:
+            asyncio.run_coroutine_threadsafe(self.error_channel.send(chunk), self.loop)
+
     def add_commands(self):
         @self.command(name="ping", description="lol")
         async def ping(ctx):
@@ -54,3 +79,30 @@ class DiscordClient(commands.Bot):
                 await ctx.channel.send(f"I am now running in dry run mode")
             else:
                 await ctx.channel.send(f"I am now NOT running in dry run mode")
+
+        @self.command(name="profile_start", brief="Profile the reddit worker for N sweeps",
+                      description="Start a sampling profiler on the reddit worker thread. After the given number "
+                                  "of sweeps, posts the top functions and wall time per Janitor method "
+                                  "(network wait, throttle sleep, python cpu) and writes a flamegraph file",
+                      usage="#profile_start 2")
+        async def profile_start(ctx, sweeps: int = 1):
+            if self.profiler is None:
+                await ctx.channel.send("Profiling is not available")
+                return
+            if sweeps < 1:
+                await ctx.channel.send("Sweeps must be at least 1")
+                return
+            if not self.profiler.start(sweeps, self.send_msg):
+                await ctx.channel.send("Profiler is already running, use #profile_stop first")
+                return
+            await ctx.channel.send(f"Profiling the reddit worker for {sweeps} sweep(s)")
+
+        @self.command(name="profile_stop", brief="Stop the profiler early and post its results")
+        async def profile_stop(ctx):
+            if self.profiler is None or not self.profiler.is_running():
+                await ctx.channel.send("Profiler is not running")
+                return
+            # joins the sampler thread, keep it off the event loop
+            report = await asyncio.get_running_loop().run_in_executor(None, self.profiler.stop)
+            if report:
+                self.send_msg(report)
@@ -0,0 +1,39 @@
+import threading
+from collections import deque
+
+
+class DiscordReporter:
+    """
+    Stands in for the discord client until it's ready, so reddit work doesn't wait on discord.
+    Messages sent before then are buffered (bounded) and flushed once the client is attached.
+    """
+    max_buffered_messages = 50
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.client = None
+        self.buffer = deque(maxlen=self.max_buffered_messages)
+
+    def attach(self, client):
+        with self.lock:
+            self.client = client
+            buffered = list(self.buffer)
+            self.buffer.clear()
+        if buffered:
+            print(f"Discord ready, sending {len(buffered)} buffered messages")
+        for send, message in buffered:
+            getattr(client, send)(message)
+
+    def send_error_msg(self, message):
+        self.send("send_error_msg", message)
+
+    def send_msg(self, message):
+        self.send("send_msg", message)
+
+    def send(self, send, message):
+        with self.lock:
+            client = self.client
+            if client is None:
+                self.buffer.append((send, message))
+                return
+        getattr(client, send)(message)
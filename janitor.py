@@ -2,29 +2,42 @@ import calendar
 import traceback
 from datetime import datetime, timedelta
 
+from action_lane import ActionLane
+from lazy_fetch_audit import LazyFetchAudit
 from post import Post
+from settings import Settings
 from submission_statement_state import SubmissionStatementState
 
 
 class Janitor:
-    def __init__(self, discord_client, bot_username, reddit, reddit_handler):
+    # praw's default listing limit, where a separate subreddit listing stops
+    listing_limit = 100
+
+    def __init__(self, discord_client, bot_username, reddit, reddit_handler, shutdown=None):
         self.discord_client = discord_client
         self.bot_username = bot_username
         self.reddit = reddit
         self.reddit_handler = reddit_handler
+        self.shutdown = shutdown
+
+    def is_shutting_down(self):
+        return self.shutdown is not None and self.shutdown.is_requested()
 
     @staticmethod
     def get_adjusted_utc_timestamp(time_difference_mins):
         adjusted_utc_dt = datetime.utcnow() - timedelta(minutes=time_difference_mins)
         return calendar.timegm(adjusted_utc_dt.utctimetuple())
 
-    def fetch_new_posts(self, settings, subreddit):
+    def fetch_new_posts(self, settings, subreddit, cache=None):
         check_posts_after_utc = self.get_adjusted_utc_timestamp(settings.post_check_threshold_mins)
 
         submissions = list()
         consecutive_old = 0
         # posts are provided in order of: newly submitted/approved (from automod block)
         for post in subreddit.new():
+            # listing data is fresh, refresh any cached copy so later handlers reuse it
+            if cache is not None:
+                post = cache.put(post)
             if post.created_utc > check_posts_after_utc:
                 submissions.append(Post(post))
                 consecutive_old = 0
@@ -38,11 +51,122 @@ class Janitor:
                 return submissions
         return submissions
 
-    def fetch_stale_unmoderated_posts(self, settings, subreddit_mod):
+    def is_combined_listing_exhausted(self, listed, uncovered, subreddit_count):
+        # checked at page boundaries, before praw requests the next page: stop once the pages used plus a
+        # separate listing for each uncovered subreddit would already cost as much as separate listings
+        if listed >= Settings.combined_listing_limit:
+            return True
+        if listed % self.listing_limit != 0:
+            return False
+        return listed // self.listing_limit + uncovered >= subreddit_count
+
+    @staticmethod
+    def use_separate_listing(subreddit_tracker, unmoderated=False):
+        # subreddits too busy for the combined listing to cover use their own listing for a while
+        if unmoderated:
+            retry_time = datetime.utcnow() + timedelta(minutes=Settings.combined_unmoderated_retry_mins)
+            subreddit_tracker.combined_unmoderated_retry_time = retry_time
+        else:
+            retry_time = datetime.utcnow() + timedelta(minutes=Settings.combined_listing_retry_mins)
+            subreddit_tracker.combined_listing_retry_time = retry_time
+        print(f"Combined {'unmoderated' if unmoderated else 'new'} listing truncated for "
+              f"{subreddit_tracker.subreddit_name}, using its own listing until {retry_time}")
+
+    def fetch_combined_new_posts(self, subreddit_trackers):
+        # one "a+b+c" listing for the subreddits, routed to each tracker with its own consecutive old stop logic
+        # returns only subreddits the listing covered, others are left to fetch their own listing
+        trackers = {tracker.subreddit_name.lower(): tracker for tracker in subreddit_trackers}
+        check_posts_after_utc = {name: self.get_adjusted_utc_timestamp(tracker.settings.post_check_threshold_mins)
+                                 for name, tracker in trackers.items()}
+        submissions = {name: list() for name in trackers}
+        consecutive_old = {name: 0 for name in trackers}
+        # consecutive posts of any subreddit older than each subreddit's window: old, approved posts show up
+        # amongst new posts, so like a separate listing the window is only passed after a run of old posts
+        consecutive_old_listed = {name: 0 for name in trackers}
+        finished = set()
+
+        def is_covered(name):
+            # stopped like a separate listing would, or the listing has gone past the subreddit's window
+            return name in finished or consecutive_old_listed[name] > trackers[name].settings.consecutive_old_posts
+
+        combined = self.reddit.subreddit("+".join(tracker.subreddit_name for tracker in subreddit_trackers))
+        listed = 0
+        truncated = False
+        for post in combined.new(limit=Settings.combined_listing_limit):
+            listed += 1
+            for name in trackers:
+                if post.created_utc > check_posts_after_utc[name]:
+                    consecutive_old_listed[name] = 0
+                else:
+                    consecutive_old_listed[name] += 1
+            name = post.subreddit.display_name.lower()
+            if name in trackers and name not in finished:
+                post = trackers[name].cache.put(post)
+                submissions[name].append(Post(post))
+                if post.created_utc > check_posts_after_utc[name]:
+                    consecutive_old[name] = 0
+                else:
+                    consecutive_old[name] += 1
+                if consecutive_old[name] > trackers[name].settings.consecutive_old_posts or \
+                        len(submissions[name]) >= self.listing_limit:
+                    finished.add(name)
+            uncovered = sum(1 for name in trackers if not is_covered(name))
+            if uncovered == 0:
+                break
+            if self.is_combined_listing_exhausted(listed, uncovered, len(trackers)):
+                truncated = True
+                break
+
+        covered = dict()
+        for name, tracker in trackers.items():
+            if truncated and not is_covered(name):
+                self.use_separate_listing(tracker)
+            else:
+                covered[tracker.subreddit_name] = submissions[name]
+        return covered
+
+    def fetch_combined_stale_unmoderated_posts(self, subreddit_trackers):
+        # returns only subreddits the listing covered, others are left to fetch their own listing
+        trackers = {tracker.subreddit_name.lower(): tracker for tracker in subreddit_trackers}
+        check_posts_before_utc = {
+            name: self.get_adjusted_utc_timestamp(tracker.settings.stale_post_check_threshold_mins)
+            for name, tracker in trackers.items()}
+        stale_unmoderated = {name: list() for name in trackers}
+        listed_per_subreddit = {name: 0 for name in trackers}
+
+        combined = self.reddit.subreddit("+".join(tracker.subreddit_name for tracker in subreddit_trackers))
+        listed = 0
+        truncated = False
+        for post in combined.mod.unmoderated(limit=Settings.combined_listing_limit):
+            listed += 1
+            name = post.subreddit.display_name.lower()
+            if name in trackers and listed_per_subreddit[name] < self.listing_limit:
+                listed_per_subreddit[name] += 1
+                post = trackers[name].cache.put(post)
+                # don't add posts which aren't old enough
+                if post.created_utc < check_posts_before_utc[name]:
+                    stale_unmoderated[name].append(Post(post))
+            uncovered = sum(1 for count in listed_per_subreddit.values() if count < self.listing_limit)
+            if self.is_combined_listing_exhausted(listed, uncovered, len(trackers)):
+                truncated = True
+                break
+
+        # covered if the listing wasn't cut off, or the subreddit got as many posts as a separate listing would
+        covered = dict()
+        for name, tracker in trackers.items():
+            if truncated and listed_per_subreddit[name] < self.listing_limit:
+                self.use_separate_listing(tracker, unmoderated=True)
+            else:
+                covered[tracker.subreddit_name] = stale_unmoderated[name]
+        return covered
+
+    def fetch_stale_unmoderated_posts(self, settings, subreddit_mod, cache=None):
         check_posts_before_utc = self.get_adjusted_utc_timestamp(settings.stale_post_check_threshold_mins)
 
         stale_unmoderated = list()
         for post in subreddit_mod.unmoderated():
+            if cache is not None:
+                post = cache.put(post)
             # don't add posts which aren't old enough
             if post.created_utc < check_posts_before_utc:
                 stale_unmoderated.append(Post(post))
@@ -86,12 +210,13 @@ class Janitor:
                 try:
                     bot_ss_comment_split = bot_ss_comment.body.split("/")
                     actual_ss_id = bot_ss_comment_split[len(bot_ss_comment_split) - 2]
-                    actual_ss = self.reddit.comment(id=actual_ss_id)
+                    actual_ss = self.get_comment(subreddit_tracker.cache, post, actual_ss_id)
                     # original ss is edited if not in bot comment --> should edit
                     if actual_ss.body not in bot_ss_comment.body and bot_ss_comment.author.name == self.bot_username:
                         print("\tActual ss has been edited. Editing bot ss")
                         submission_statement_content = settings.submission_statement_pin_text(actual_ss, ss_prefix)
-                        self.reddit_handler.edit_content(bot_ss_comment, submission_statement_content)
+                        self.reddit_handler.edit_content(bot_ss_comment, submission_statement_content,
+                                                         lane=ActionLane.ON_TOPIC)
                 except Exception as e:
                     message = f"Exception in identifying ss edits, won't edit." \
                               f" {post.submission.title}: {e}\n```{traceback.format_exc()}```"
@@ -118,7 +243,8 @@ class Janitor:
                                "If a submission statement is not added, your post will be automatically removed.\n\n" \
                                "For full rules, see: https://www.reddit.com/r/UFOs/wiki/rules/\n\n" \
                                "*This is an automated message. Responses to this comment are not monitored. Please [message the moderators](https://www.reddit.com/message/compose?to=/r/UFOs) if you believe this was an error.*"
-                        self.reddit_handler.reply_to_content(post.submission, text, pin=False, lock=True)
+                        self.reddit_handler.reply_to_content(post.submission, text, pin=False, lock=True,
+                                                             lane=ActionLane.REMINDER)
             else:
                 print("\tPost has valid post-based submission statement, a comment based ss is optional")
                 ss_optional = True
@@ -207,12 +333,7 @@ class Janitor:
                 bot_comment = reply
                 break
 
-        text = submission_statement.body.lower()
-        contains_on_topic_keyword = False
-        for keyword in settings.submission_statement_on_topic_keywords:
-            if keyword in text:
-                contains_on_topic_keyword = True
-                break
+        contains_on_topic_keyword = settings.contains_on_topic_keyword(submission_statement.body)
 
         # remove bot comment if post is approved or has been edited to contain a keyword
         if post.submission.approved:
@@ -230,7 +351,7 @@ class Janitor:
         elif bot_comment and bot_comment.score > settings.submission_statement_on_topic_report_score:
             reason = f"Bot on-topic comment upvoted too much: " \
                      f"Check post is related to collapse and ss is good"
-            self.reddit_handler.report_content(post.submission, reason)
+            self.reddit_handler.report_content(post.submission, reason, lane=ActionLane.MAINTENANCE)
 
         # bot comment exists, or ss is already on topic
         if bot_comment or contains_on_topic_keyword:
@@ -242,7 +363,8 @@ class Janitor:
                    f"Keeping content on-topic is important to our community, and submission statements help achieve " \
                    f"that. Thanks for your submission!"
         comment = self.reddit_handler.reply_to_content(submission_statement, response,
-                                                       pin=False, lock=True, ignore_reports=True)
+                                                       pin=False, lock=True, ignore_reports=True,
+                                                       lane=ActionLane.ON_TOPIC)
         if comment is not None and settings.submission_statement_on_topic_check_downvotes:
             monitored_ss_replies.append(comment.id)
 
@@ -272,28 +394,31 @@ class Janitor:
                             f"{settings.submission_statement_rule_description}.\n\n" \
                             "Please message the moderators if you feel this was an error. " \
                             "Responses to this comment are not monitored."
-        self.reddit_handler.reply_to_content(post.submission, reminder_response, pin=False, lock=True)
+        self.reddit_handler.reply_to_content(post.submission, reminder_response, pin=False, lock=True,
+                                             lane=ActionLane.REMINDER)
 
-    def handle_posts(self, subreddit_tracker):
+    def handle_posts(self, subreddit_tracker, posts=None):
         settings = subreddit_tracker.settings
         subreddit = subreddit_tracker.subreddit
-        posts = self.fetch_new_posts(settings, subreddit)
+        if posts is None:
+            posts = self.fetch_new_posts(settings, subreddit, subreddit_tracker.cache)
         print("Checking " + str(len(posts)) + " posts")
         for post in posts:
+            if self.is_shutting_down():
+                print("Shutting down, not checking remaining posts")
+                return
             print(f"Checking post: {post.submission.title}\n\t{post.submission.permalink}")
 
             # Skip posts with excluded flairs
             flair = post.submission.link_flair_text
-            if flair and flair.lower() in [f.lower() for f in settings.excluded_flairs]:
+            if flair and flair.lower() in settings.excluded_flair_set:
                 print(f"\tSkipping post with excluded flair: {flair}")
                 continue
 
             try:
                 self.handle_low_effort(settings, post)
                 flair_prefix = settings.flair_pin_text(post.submission.link_flair_text)
-                is_crosspost = (not post.submission.is_self and ("reddit.com" in post.submission.url)) or \
-                               (hasattr(post.submission, 'crosspost_parent') and post.submission.crosspost_parent)
-                crosspost_prefix = settings.submission_statement_crosspost_prefix if is_crosspost else ""
+                crosspost_prefix = settings.submission_statement_crosspost_prefix if post.is_crosspost() else ""
                 prefix = f"{crosspost_prefix}\n\n---\n\n{flair_prefix}" if flair_prefix and crosspost_prefix \
                     else crosspost_prefix + flair_prefix
                 self.handle_submission_statement(subreddit_tracker, post, prefix)
@@ -302,22 +427,32 @@ class Janitor:
                 self.discord_client.send_error_msg(message)
                 print(message)
 
-    def handle_stale_unmoderated_posts(self, subreddit_tracker):
+    @staticmethod
+    def is_stale_unmoderated_check_due(subreddit_tracker, now):
+        last_checked = subreddit_tracker.time_unmoderated_last_checked
+        return last_checked <= now - timedelta(minutes=subreddit_tracker.settings.stale_post_check_frequency_mins)
+
+    def handle_stale_unmoderated_posts(self, subreddit_tracker, stale_unmoderated_posts=None):
         now = datetime.utcnow()
         settings = subreddit_tracker.settings
         subreddit_mod = subreddit_tracker.subreddit.mod
-        last_checked = subreddit_tracker.time_unmoderated_last_checked
-        if last_checked > now - timedelta(minutes=settings.stale_post_check_frequency_mins):
+        if not self.is_stale_unmoderated_check_due(subreddit_tracker, now):
             return
 
-        stale_unmoderated_posts = self.fetch_stale_unmoderated_posts(settings, subreddit_mod)
+        if stale_unmoderated_posts is None:
+            stale_unmoderated_posts = self.fetch_stale_unmoderated_posts(settings, subreddit_mod,
+                                                                         subreddit_tracker.cache)
         print("__UNMODERATED__")
         for post in stale_unmoderated_posts:
+            if self.is_shutting_down():
+                # leave last checked as-is so the remaining posts are reported after restart
+                print("Shutting down, not checking remaining unmoderated posts")
+                return
             print(f"Checking unmoderated post: {post.submission.title}")
             if settings.report_stale_unmoderated_posts:
                 rounded_time = str(round(settings.stale_post_check_threshold_mins / 60, 2))
                 reason = f"This post is over {rounded_time} hours old and has not been moderated. Please take a look!"
-                self.reddit_handler.report_content(post.submission, reason)
+                self.reddit_handler.report_content(post.submission, reason, lane=ActionLane.MAINTENANCE)
             else:
                 print(f"Not reporting stale unmoderated post: {post.submission.title}\n\t{post.submission.permalink}")
         subreddit_tracker.time_unmoderated_last_checked = now
@@ -330,32 +465,62 @@ class Janitor:
         print(f"Monitored ss replies: {str(list(subreddit_tracker.monitored_ss_replies))}")
         removal_score = settings.submission_statement_on_topic_removal_score
         for comment_id in list(subreddit_tracker.monitored_ss_replies):
+            if self.is_shutting_down():
+                return
+            # comment is always refetched for its current score, its post is usually cached from this sweep's listing
             comment = self.reddit.comment(id=comment_id)
+            submission = None
+            with LazyFetchAudit.expected():
+                if comment is not None and not isinstance(comment.author, type(None)) and not comment.removed:
+                    submission = self.get_submission(subreddit_tracker.cache, comment)
             # deleted/removed comment or post
-            if comment is None or isinstance(comment.author, type(None)) or comment.removed \
-                    or isinstance(comment.submission.author, type(None)) or comment.submission.removed:
+            if submission is None or isinstance(submission.author, type(None)) or submission.removed:
                 print(f"Not monitoring {comment_id} anymore, comment or post is removed/deleted")
                 subreddit_tracker.monitored_ss_replies.remove(comment_id)
             elif comment.score < removal_score:
                 self.remove_on_topic(subreddit_tracker.monitored_ss_replies, comment,
                                      f"Removed {comment_id} due to low score: {str(comment.score)}")
-            elif comment.submission.approved:
+            elif submission.approved:
                 self.remove_on_topic(subreddit_tracker.monitored_ss_replies, comment,
                                      f"Removed {comment_id} due to approved post")
             elif comment.created_utc < self.get_adjusted_utc_timestamp(60 * 24):
                 print(f"Not monitoring {comment_id} anymore, over 1 day old and has [{str(comment.score)}] score")
                 subreddit_tracker.monitored_ss_replies.remove(comment_id)
 
+    def get_submission(self, cache, comment):
+        submission = cache.get(comment.link_id)
+        if submission is None:
+            with LazyFetchAudit.expected():
+                submission = cache.put(LazyFetchAudit.fetch_now(comment.submission, "author"))
+        return submission
+
+    def get_comment(self, cache, post, comment_id):
+        # the post's comments were just loaded this sweep, so prefer them over the cache and a fetch
+        for comment in post.comments():
+            if getattr(comment, "id", None) == comment_id:
+                return cache.put(comment)
+        comment = cache.get(f"t1_{comment_id}")
+        if comment is None:
+            comment = cache.put(LazyFetchAudit.fetch_now(self.reddit.comment(id=comment_id), "body"))
+        return comment
+
     def remove_bot_comments(self, post):
-        for comment in post.submission.comments:
+        for comment in post.comments():
             # deleted comment
             if isinstance(comment.author, type(None)) or comment.removed:
                 continue
             if comment.author.name == self.bot_username:
                 removal_reason = "Cleaned up non-submission statement comment"
-                self.reddit_handler.remove_content(comment, removal_reason, removal_reason, reply=False)
+                self.reddit_handler.remove_content(comment, removal_reason, removal_reason, reply=False,
+                                                   lane=ActionLane.MAINTENANCE)
 
     def remove_on_topic(self, monitored_ss_replies, bot_comment, reason):
         if bot_comment in monitored_ss_replies:
-            self.reddit_handler.remove_content(bot_comment, reason, reason, reply=False)
-            monitored_ss_replies.remove(bot_comment.id)
+            comment_id = bot_comment.id
+
+            # stop monitoring only once removed, a failed or dropped removal is retried next sweep
+            def stop_monitoring():
+                if comment_id in monitored_ss_replies:
+                    monitored_ss_replies.remove(comment_id)
+            self.reddit_handler.remove_content(bot_comment, reason, reason, reply=False,
+                                               lane=ActionLane.MAINTENANCE, on_removed=stop_monitoring)
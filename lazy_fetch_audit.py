@@ -0,0 +1,104 @@
+import functools
+import os
+import sys
+import threading
+from collections import Counter
+from contextlib import contextmanager
+
+
+class UnexpectedLazyFetch(RuntimeError):
+    pass
+
+
+class LazyFetchAudit:
+    """
+    Counts praw lazy fetches (attribute access on an unfetched object) and http requests per bot call site.
+    Fetches the bot intends to make are wrapped in expected(), in strict mode any other lazy fetch raises
+    UnexpectedLazyFetch, so tests can prove a code path doesn't make hidden requests.
+    """
+    strict = False
+    installed = False
+    lazy_fetches = Counter()
+    unexpected_fetches = Counter()
+    requests = Counter()
+    state = threading.local()
+    # frames from these are skipped when finding the bot call site
+    library_dirs = (os.sep + "praw" + os.sep, os.sep + "prawcore" + os.sep, os.sep + "requests" + os.sep,
+                    os.sep + "urllib3" + os.sep)
+
+    @classmethod
+    def install(cls, strict=False):
+        cls.strict = strict
+        if cls.installed:
+            return
+        from praw.models import Comment, Redditor, Submission, Subreddit, WikiPage
+        from prawcore import Session
+        for model in (Comment, Redditor, Submission, Subreddit, WikiPage):
+            model._fetch = cls.wrap_fetch(model._fetch, model.__name__)
+        Session.request = cls.wrap_request(Session.request)
+        cls.installed = True
+
+    @classmethod
+    @contextmanager
+    def expected(cls):
+        cls.state.expected_depth = getattr(cls.state, "expected_depth", 0) + 1
+        try:
+            yield
+        finally:
+            cls.state.expected_depth -= 1
+
+    @classmethod
+    def fetch_now(cls, obj, attribute):
+        # load a lazy object up front, while its fetch is expected, reading attribute to trigger the fetch
+        with cls.expected():
+            getattr(obj, attribute)
+        return obj
+
+    @classmethod
+    def is_expected(cls):
+        return getattr(cls.state, "expected_depth", 0) > 0
+
+    @classmethod
+    def call_site(cls):
+        frame = sys._getframe(2)
+        while frame is not None:
+            filename = frame.f_code.co_filename
+            if filename != __file__ and not any(library_dir in filename for library_dir in cls.library_dirs):
+                return f"{os.path.basename(filename)}:{frame.f_lineno} {frame.f_code.co_name}"
+            frame = frame.f_back
+        return "<unknown>"
+
+    @classmethod
+    def wrap_fetch(cls, fetch, model_name):
+        @functools.wraps(fetch)
+        def audited_fetch(obj, *args, **kwargs):
+            site = f"{cls.call_site()} ({model_name})"
+            cls.lazy_fetches[site] += 1
+            if not cls.is_expected():
+                cls.unexpected_fetches[site] += 1
+                if cls.strict:
+                    raise UnexpectedLazyFetch(f"Unexpected lazy fetch of {model_name} {obj} at {site}")
+            return fetch(obj, *args, **kwargs)
+        return audited_fetch
+
+    @classmethod
+    def wrap_request(cls, request):
+        @functools.wraps(request)
+        def audited_request(session, *args, **kwargs):
+            cls.requests[cls.call_site()] += 1
+            return request(session, *args, **kwargs)
+        return audited_request
+
+    @classmethod
+    def report_and_reset(cls, top_sites=10):
+        lines = [f"Sweep made {sum(cls.requests.values())} reddit requests, "
+                 f"{sum(cls.lazy_fetches.values())} lazy fetches "
+                 f"({sum(cls.unexpected_fetches.values())} unexpected)"]
+        for site, count in cls.requests.most_common(top_sites):
+            lines.append(f"\trequests {count}: {site}")
+        for site, count in cls.unexpected_fetches.most_common(top_sites):
+            lines.append(f"\tunexpected lazy fetches {count}: {site}")
+        cls.lazy_fetches.clear()
+        cls.unexpected_fetches.clear()
+        cls.requests.clear()
+        return "\n".join(lines)
@@ -0,0 +1,111 @@
+import sys
+import time
+from collections import OrderedDict
+
+
+class ObjectCache:
+    """
+    Per subreddit cache of reddit objects (submissions, comments) keyed by fullname, shared across handlers.
+    Entries expire after ttl_secs, and the least recently used are evicted beyond max_entries or max_bytes.
+    Putting an object which is already cached refreshes the cached object in place, so references held
+    elsewhere see the fresh data.
+    Sizes are shallow, so objects which have since loaded a comment forest are released at the end of each
+    sweep (release_loaded()), keeping the byte cap a bound on what the cache holds between sweeps.
+    """
+
+    def __init__(self, ttl_secs, max_entries, max_bytes):
+        self.ttl_secs = ttl_secs
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        # fullname -> (stored time, object, estimated bytes)
+        self.entries = OrderedDict()
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.releases = 0
+
+    @staticmethod
+    def estimate_size(obj):
+        # shallow estimate, objects which load a comment forest are released each sweep
+        return sys.getsizeof(obj) + sum(sys.getsizeof(value) for value in vars(obj).values())
+
+    @staticmethod
+    def has_loaded_comments(obj):
+        # praw caches a submission's forest as "comments" and a comment's replies as "_replies"
+        obj_vars = vars(obj)
+        return "comments" in obj_vars or "_comments" in obj_vars or bool(obj_vars.get("_replies"))
+
+    def is_expired(self, stored_time, now):
+        return now - stored_time > self.ttl_secs
+
+    def get(self, fullname):
+        entry = self.entries.get(fullname)
+        if entry is None:
+            self.misses += 1
+            return None
+        stored_time, obj, size = entry
+        if self.is_expired(stored_time, time.time()):
+            self.remove(fullname)
+            self.expirations += 1
+            self.misses += 1
+            return None
+        self.entries.move_to_end(fullname)
+        self.hits += 1
+        return obj
+
+    def put(self, obj):
+        self.purge_expired()
+        fullname = obj.fullname
+        entry = self.entries.get(fullname)
+        if entry is not None and entry[1] is not obj:
+            cached = entry[1]
+            # replace rather than merge, so lazily loaded data (e.g. a stale comment forest) isn't kept
+            vars(cached).clear()
+            vars(cached).update(vars(obj))
+            obj = cached
+        if entry is not None:
+            self.remove(fullname)
+        size = self.estimate_size(obj)
+        self.entries[fullname] = (time.time(), obj, size)
+        self.total_bytes += size
+        self.evict()
+        return obj
+
+    def remove(self, fullname):
+        stored_time, obj, size = self.entries.pop(fullname)
+        self.total_bytes -= size
+
+    def purge_expired(self):
+        # entries are in LRU order, not stored order, so check them all
+        now = time.time()
+        expired = [fullname for fullname, (stored_time, obj, size) in self.entries.items()
+                   if self.is_expired(stored_time, now)]
+        for fullname in expired:
+            self.remove(fullname)
+            self.expirations += 1
+
+    def release_loaded(self):
+        # called at the end of a sweep: drop expired entries and anything holding a comment forest
+        self.purge_expired()
+        loaded = [fullname for fullname, (stored_time, obj, size) in self.entries.items()
+                  if self.has_loaded_comments(obj)]
+        for fullname in loaded:
+            self.remove(fullname)
+            self.releases += 1
+
+    def clear(self):
+        self.entries.clear()
+        self.total_bytes = 0
+
+    def evict(self):
+        while self.entries and (len(self.entries) > self.max_entries or self.total_bytes > self.max_bytes):
+            fullname = next(iter(self.entries))
+            self.remove(fullname)
+            self.evictions += 1
+
+    def __str__(self):
+        return f"Cache: {len(self.entries)} entries (~{self.total_bytes // 1024}KB), {self.hits} hits, " \
+               f"{self.misses} misses, {self.evictions} evictions, {self.expirations} expirations, " \
+               f"{self.releases} released"
@@ -1,5 +1,7 @@
 from datetime import datetime, timedelta
 
+from lazy_fetch_audit import LazyFetchAudit
+
 
 class Post:
     def __init__(self, submission):
@@ -13,7 +15,7 @@ class Post:
         flair = self.submission.link_flair_text
         if not flair:
             return False
-        if flair.lower() in settings.low_effort_flair:
+        if flair.lower() in settings.low_effort_flair_set:
             return True
         return False
 
@@ -24,8 +26,19 @@ class Post:
             return True
         return False
 
+    def is_crosspost(self):
+        # read the listing data directly, hasattr would trigger a full fetch for posts without the attribute
+        if not self.submission.is_self and "reddit.com" in self.submission.url:
+            return True
+        return bool(vars(self.submission).get("crosspost_parent"))
+
+    def comments(self):
+        # loading the comment forest is the one expected fetch per checked post
+        with LazyFetchAudit.expected():
+            return list(self.submission.comments)
+
     def find_comment_containing(self, text, include_deleted=False):
-        for comment in self.submission.comments:
+        for comment in self.comments():
             if not include_deleted:
                 if isinstance(comment.author, type(None)) or comment.removed:
                     continue
@@ -39,7 +52,7 @@ class Post:
 
     def find_submission_statement(self):
         ss_candidates = []
-        for comment in self.submission.comments:
+        for comment in self.comments():
             if comment.is_submitter:
                 ss_candidates.append(comment)
 
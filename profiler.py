@@ -0,0 +1,139 @@
+import os
+import sys
+import threading
+import time
+from collections import Counter, defaultdict
+
+
+class SweepProfiler:
+    """
+    Low overhead sampling profiler for the reddit worker thread, started/stopped from discord.
+    Samples the worker's stack every interval_secs and attributes each sample to the innermost Janitor method,
+    split into network wait, throttle sleep, idle (between sweeps) and python cpu.
+    """
+    network_files = ("socket.py", "ssl.py", "selectors.py")
+    throttle_frames = (("reddit_actions_handler.py", "reddit_call"),)
+    idle_frames = (("shutdown.py", "wait"),)
+
+    def __init__(self, thread_id, output_dir, interval_secs=0.01):
+        self.thread_id = thread_id
+        self.output_dir = output_dir
+        self.interval_secs = interval_secs
+        self.lock = threading.Lock()
+        self.sampler = None
+        self.running = False
+        self.sweeps_remaining = 0
+        self.on_complete = None
+        self.start_time = 0
+        self.reset()
+
+    def reset(self):
+        self.sample_count = 0
+        self.folded_stacks = Counter()
+        self.self_samples = Counter()
+        self.breakdown = defaultdict(Counter)
+
+    def is_running(self):
+        return self.running
+
+    def start(self, sweeps, on_complete):
+        with self.lock:
+            if self.running:
+                return False
+            self.reset()
+            self.sweeps_remaining = sweeps
+            self.on_complete = on_complete
+            self.start_time = time.time()
+            self.running = True
+            self.sampler = threading.Thread(target=self.sample_loop, name="sweep-profiler", daemon=True)
+            self.sampler.start()
+            return True
+
+    def stop(self):
+        with self.lock:
+            if not self.running:
+                return None
+            self.running = False
+        self.sampler.join()
+        elapsed_secs = time.time() - self.start_time
+        flamegraph_path = self.write_flamegraph()
+        return self.format_report(elapsed_secs, flamegraph_path)
+
+    def on_sweep_complete(self):
+        # called by the reddit worker after each full sweep of all subreddits
+        if not self.running:
+            return
+        self.sweeps_remaining -= 1
+        if self.sweeps_remaining > 0:
+            return
+        report = self.stop()
+        if report and self.on_complete:
+            self.on_complete(report)
+
+    def sample_loop(self):
+        while self.running:
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is not None:
+                self.record_sample(frame)
+            time.sleep(self.interval_secs)
+
+    def record_sample(self, frame):
+        stack = list()
+        while frame is not None:
+            code = frame.f_code
+            stack.append((os.path.basename(code.co_filename), code.co_name))
+            frame = frame.f_back
+        stack.reverse()
+
+        janitor_method = "<outside Janitor>"
+        for filename, function in reversed(stack):
+            if filename == "janitor.py":
+                janitor_method = function
+                break
+
+        self.sample_count += 1
+        self.folded_stacks[";".join(f"{filename}:{function}" for filename, function in stack)] += 1
+        self.self_samples[f"{stack[-1][0]}:{stack[-1][1]}"] += 1
+        self.breakdown[janitor_method][self.classify(stack)] += 1
+
+    def classify(self, stack):
+        # idle waits block deeper in threading.py, so look for them anywhere in the stack
+        if any(frame in self.idle_frames for frame in stack):
+            return "idle"
+        leaf = stack[-1]
+        if leaf[0] in self.network_files:
+            return "network"
+        if leaf in self.throttle_frames:
+            return "throttle"
+        return "cpu"
+
+    def write_flamegraph(self):
+        # collapsed stack format, compatible with flamegraph.pl and speedscope
+        path = os.path.join(self.output_dir, f"profile_{time.strftime('%Y%m%d_%H%M%S')}.folded")
+        try:
+            with open(path, "w") as folded_file:
+                for stack, count in self.folded_stacks.most_common():
+                    folded_file.write(f"{stack} {count}\n")
+        except OSError as e:
+            print(f"Could not write flamegraph file {path}: {e}")
+            return None
+        return path
+
+    def format_report(self, elapsed_secs, flamegraph_path, top_functions=10):
+        secs_per_sample = elapsed_secs / self.sample_count if self.sample_count else 0
+        lines = [f"Profiled {elapsed_secs:.1f}s of the reddit worker ({self.sample_count} samples)"]
+
+        lines.append("\nWall time by Janitor method (network / throttle / cpu / idle):")
+        by_total = sorted(self.breakdown.items(), key=lambda item: sum(item[1].values()), reverse=True)
+        for method, categories in by_total:
+            split = " / ".join(f"{categories[category] * secs_per_sample:.1f}s"
+                               for category in ("network", "throttle", "cpu", "idle"))
+            lines.append(f"  {method}: {sum(categories.values()) * secs_per_sample:.1f}s ({split})")
+
+        lines.append(f"\nTop {top_functions} functions (self time):")
+        for function, count in self.self_samples.most_common(top_functions):
+            lines.append(f"  {function}: {count * secs_per_sample:.2f}s ({100 * count / self.sample_count:.0f}%)")
+
+        if flamegraph_path:
+            lines.append(f"\nFlamegraph stacks written to {flamegraph_path}")
+        return "\n".join(lines)
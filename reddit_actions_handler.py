@@ -1,6 +1,10 @@
 import time
 import traceback
+from collections import deque
+from contextlib import contextmanager
 
+from action_lane import ActionLane, LaneStats
+from lazy_fetch_audit import LazyFetchAudit
 from settings import Settings
 from praw.exceptions import RedditAPIException
 
@@ -9,53 +13,245 @@ class RedditActionsHandler:
     max_retries = 3
     retry_delay_secs = 10
 
-    def __init__(self, reddit, discord_client):
+    def __init__(self, reddit, discord_client, journal=None, shutdown=None):
         self.reddit = reddit
         self.discord_client = discord_client
+        self.journal = journal
+        self.shutdown = shutdown
         self.last_call_time = 0
+        # maintenance actions don't need their result, so they queue behind time critical actions
+        self.deferred_actions = deque()
+        self.lane_stats = {lane: LaneStats() for lane in ActionLane}
+        # how many action chains (e.g. remove -> reply -> distinguish) are in progress
+        self.chain_depth = 0
 
-    def remove_content(self, content, external_removal_reason, internal_removal_reason, reply=True):
+    @contextmanager
+    def action_chain(self, lane, description):
+        # yields whether the chain may start: once the shutdown drain budget is spent no new chain starts,
+        # in-flight chains finish. Starved maintenance runs before a chain's first call, never between its steps
+        if self.chain_depth == 0:
+            if self.drain_budget_spent():
+                print(f"\tShutting down, not starting {description}")
+                yield False
+                return
+            if lane != ActionLane.MAINTENANCE:
+                self.run_starved_actions()
+        self.chain_depth += 1
+        try:
+            yield True
+        finally:
+            self.chain_depth -= 1
+
+    def remove_content(self, content, external_removal_reason, internal_removal_reason, reply=True,
+                       lane=ActionLane.DEADLINE, on_removed=None):
+        # on_removed is called once the content is removed (or already gone), which may be later when deferred
         if content is None or isinstance(content.author, type(None)) or content.removed:
             print(f"\tWould remove, but deleted content - not removing {content}, reason: {internal_removal_reason}")
+            if on_removed:
+                on_removed()
             return
         print(f"\tRemoving content {content}, reason: {internal_removal_reason}")
-        self.reddit_call(lambda: content.mod.remove(mod_note=internal_removal_reason))
-        if reply:
-            self.reply_to_content(content, external_removal_reason)
+        remove = lambda: content.mod.remove(mod_note=internal_removal_reason)
+        if lane == ActionLane.MAINTENANCE and not reply:
+            self.defer_call(remove, f"remove {content}", on_removed)
+            return
+        with self.action_chain(lane, f"remove {content}") as started:
+            if not started:
+                return
+            journal_id = None
+            # journal the whole chain before removing, so a removal interrupted before its reply is still
+            # replied to on next startup
+            if reply and self.journal and not Settings.is_dry_run:
+                journal_id = content.fullname
+                self.journal.begin_removal_chain(journal_id, internal_removal_reason, external_removal_reason,
+                                                 pin=True, lock=False, ignore_reports=False)
+            try:
+                self.reddit_call(remove, lane=lane)
+            except Exception:
+                # nothing happened, the content is found again by a later sweep
+                if journal_id:
+                    self.journal.finish(journal_id)
+                raise
+            if journal_id:
+                self.journal.complete_step(journal_id, "remove")
+            if on_removed:
+                on_removed()
+            if reply:
+                self.reply_to_content(content, external_removal_reason, lane=lane, journal_id=journal_id)
 
-    def report_content(self, content, reason):
+    def report_content(self, content, reason, lane=ActionLane.DEADLINE):
         print(f"\tReporting content {content}, reason: {reason}")
-        self.reddit_call(lambda: content.report(reason))
+        report = lambda: content.report(reason)
+        if lane == ActionLane.MAINTENANCE:
+            self.defer_call(report, f"report {content}")
+            return
+        with self.action_chain(lane, f"report {content}") as started:
+            if not started:
+                return
+            self.reddit_call(report, lane=lane)
 
-    def reply_to_content(self, content, reason, pin=True, lock=False, ignore_reports=False):
+    def reply_to_content(self, content, reason, pin=True, lock=False, ignore_reports=False,
+                         lane=ActionLane.DEADLINE, journal_id=None):
+        # journal_id is the journaled chain this reply continues, e.g. a removal
         print(f"\tReplying to content {content}, reason: {reason}")
         max_chars = 10000
         if len(reason) > max_chars:
             print(f"Warning: Reason has been truncated to {max_chars} characters")
             reason = reason[:max_chars]
-        reply_comment = self.reddit_call(lambda: content.reply(reason))
-        self.reddit_call(lambda: reply_comment.mod.distinguish(sticky=pin), reddit_throttle_secs=1)
+        with self.action_chain(lane, f"reply to {content}") as started:
+            if not started:
+                return None
+            reply_comment = self.reddit_call(lambda: content.reply(reason), lane=lane)
+            if reply_comment is None:
+                return reply_comment
+            # journal the rest of the chain, so an interrupted chain is finished on next startup
+            if self.journal:
+                self.journal.begin_reply_chain(reply_comment.id, pin, lock, ignore_reports, replaces=journal_id)
+            self.finish_reply_chain(reply_comment, pin, lock, ignore_reports, lane=lane)
+        return reply_comment
+
+    def finish_reply_chain(self, reply_comment, pin, lock, ignore_reports, completed=(), lane=ActionLane.DEADLINE):
+        steps = [("distinguish", lambda: reply_comment.mod.distinguish(sticky=pin))]
         if lock:
-            self.reddit_call(lambda: reply_comment.mod.lock(), reddit_throttle_secs=1)
+            steps.append(("lock", lambda: reply_comment.mod.lock()))
         if ignore_reports:
-            self.reddit_call(lambda: reply_comment.mod.ignore_reports(), reddit_throttle_secs=1)
-        return reply_comment
+            steps.append(("ignore_reports", lambda: reply_comment.mod.ignore_reports()))
+        for step, callback in steps:
+            if step in completed:
+                continue
+            self.reddit_call(callback, reddit_throttle_secs=1, lane=lane)
+            if self.journal:
+                self.journal.complete_step(reply_comment.id, step)
+        if self.journal:
+            self.journal.finish(reply_comment.id)
 
-    def edit_content(self, content, body):
+    def resume_journaled_actions(self):
+        if not self.journal:
+            return
+        for comment_id, entry in self.journal.pending().items():
+            if "reply" in entry:
+                self.resume_removal_chain(comment_id, entry)
+                continue
+            print(f"Resuming interrupted reply chain for comment {comment_id}, completed: {entry['completed']}")
+            try:
+                comment = self.reddit.comment(id=comment_id)
+                with LazyFetchAudit.expected():
+                    comment_deleted = isinstance(comment.author, type(None)) or comment.removed
+                if comment_deleted:
+                    print(f"\tComment {comment_id} is removed/deleted, dropping from journal")
+                    self.journal.finish(comment_id)
+                    continue
+                self.finish_reply_chain(comment, entry["pin"], entry["lock"], entry["ignore_reports"],
+                                        completed=entry["completed"])
+            except Exception as e:
+                message = f"Exception resuming reply chain for comment {comment_id}: {e}\n" \
+                          f"```{traceback.format_exc()}```"
+                self.discord_client.send_error_msg(message)
+                print(message)
+
+    def resume_removal_chain(self, fullname, entry):
+        print(f"Resuming interrupted removal of {fullname}, completed: {entry['completed']}")
+        try:
+            content_id = fullname.split("_", 1)[1]
+            if fullname.startswith("t3_"):
+                content = self.reddit.submission(id=content_id)
+            else:
+                content = self.reddit.comment(id=content_id)
+            with LazyFetchAudit.expected():
+                content_deleted = isinstance(content.author, type(None))
+                # removed by us before the step was journaled, or by another mod: either way it gets the reply
+                content_removed = content.removed
+            if content_deleted:
+                print(f"\t{fullname} is deleted, dropping from journal")
+                self.journal.finish(fullname)
+                return
+            if "remove" not in entry["completed"] and not content_removed:
+                self.reddit_call(lambda: content.mod.remove(mod_note=entry["mod_note"]))
+            self.journal.complete_step(fullname, "remove")
+            self.reply_to_content(content, entry["reply"], entry["pin"], entry["lock"], entry["ignore_reports"],
+                                  journal_id=fullname)
+        except Exception as e:
+            message = f"Exception resuming removal of {fullname}: {e}\n```{traceback.format_exc()}```"
+            self.discord_client.send_error_msg(message)
+            print(message)
+
+    def edit_content(self, content, body, lane=ActionLane.ON_TOPIC):
         print(f"\tEditing content {content}, body: {body}")
-        self.reddit_call(lambda: content.edit(body))
+        with self.action_chain(lane, f"edit {content}") as started:
+            if not started:
+                return
+            self.reddit_call(lambda: content.edit(body), lane=lane)
+
+    def defer_call(self, callback, description, on_success=None):
+        if Settings.is_dry_run:
+            print("\tDRY RUN!!!")
+            if on_success:
+                on_success()
+            return
+        # the same cleanup can be found again by a later sweep before it has run
+        if any(queued[2] == description for queued in self.deferred_actions):
+            print(f"\tAlready deferred {description}")
+            return
+        print(f"\tDeferring {description} to maintenance lane ({len(self.deferred_actions)} queued)")
+        self.deferred_actions.append((time.time(), callback, description, on_success))
+
+    def run_deferred_actions(self, max_actions=None, starved_only=False):
+        # oldest first, at most max_actions
+        max_wait_secs = Settings.maintenance_max_wait_mins * 60
+        ran = 0
+        while self.deferred_actions:
+            queued_time, callback, description, on_success = self.deferred_actions[0]
+            if max_actions is not None and ran >= max_actions:
+                break
+            if starved_only and time.time() - queued_time <= max_wait_secs:
+                break
+            if self.shutdown and self.shutdown.is_requested() and self.shutdown.remaining_budget_secs() <= 0:
+                # callers keep their state (e.g. monitored replies) until on_success, so these are found again
+                print(f"Shutting down, leaving {len(self.deferred_actions)} deferred maintenance actions undone")
+                break
+            self.deferred_actions.popleft()
+            ran += 1
+            try:
+                self.reddit_call(callback, lane=ActionLane.MAINTENANCE, queued_time=queued_time)
+                if on_success:
+                    on_success()
+            except Exception as e:
+                message = f"Exception in deferred action {description}: {e}\n```{traceback.format_exc()}```"
+                self.discord_client.send_error_msg(message)
+                print(message)
 
-    def reddit_call(self, callback, reddit_throttle_secs=5):
+    def flush_deferred_actions(self):
+        if not self.deferred_actions:
+            return
+        print(f"Running up to {Settings.maintenance_actions_per_flush} of "
+              f"{len(self.deferred_actions)} deferred maintenance actions")
+        self.run_deferred_actions(Settings.maintenance_actions_per_flush)
+
+    def run_starved_actions(self):
+        # maintenance waiting over max wait gets a few actions ahead of each critical action chain, so it can't
+        # be starved by a steady stream of critical actions, without a backlog delaying the critical action much
+        if self.deferred_actions:
+            self.run_deferred_actions(Settings.maintenance_starved_actions_per_call, starved_only=True)
+
+    def lane_stats_summary(self):
+        lines = [f"\t{lane.name}: {self.lane_stats[lane]}" for lane in ActionLane]
+        return "Action lanes:\n" + "\n".join(lines) + f"\n\t{len(self.deferred_actions)} deferred actions queued"
+
+    def reddit_call(self, callback, reddit_throttle_secs=5, lane=ActionLane.DEADLINE, queued_time=None):
         if Settings.is_dry_run:
             print("\tDRY RUN!!!")
             return
+        if queued_time is None:
+            queued_time = time.time()
         # throttle reddit calls to prevent reddit throttling
         elapsed_time = time.time() - self.last_call_time
         if elapsed_time < reddit_throttle_secs:
-            time.sleep(reddit_throttle_secs - elapsed_time)
+            self.throttle_sleep(reddit_throttle_secs - elapsed_time)
         # retry reddit exceptions, such as throttling or reddit issues
         for i in range(self.max_retries):
             try:
+                if i == 0:
+                    self.lane_stats[lane].record(time.time() - queued_time)
                 result = callback()
                 self.last_call_time = time.time()
                 return result
@@ -63,8 +259,27 @@ class RedditActionsHandler:
                 message = f"Exception in RedditRetry: {e}\n```{traceback.format_exc()}```"
                 self.discord_client.send_error_msg(message)
                 print(message)
-                if i < self.max_retries - 1:
+                if i < self.max_retries - 1 and not self.shutdown_budget_exceeded(self.retry_delay_secs):
                     print(f"Retrying in {self.retry_delay_secs} seconds...")
-                    time.sleep(self.retry_delay_secs)
+                    self.throttle_sleep(self.retry_delay_secs)
                 else:
                     raise e
+
+    def throttle_sleep(self, sleep_secs):
+        if self.shutdown is None:
+            time.sleep(sleep_secs)
+            return
+        # a signal doesn't cut time.sleep short, so wait on the shutdown event instead
+        wake_time = time.time() + sleep_secs
+        self.shutdown.wait(sleep_secs)
+        if self.shutdown.is_requested():
+            # squeeze the in-flight chain into the remaining drain budget
+            time.sleep(max(0.0, min(wake_time - time.time(), self.shutdown.remaining_budget_secs())))
+
+    def drain_budget_spent(self):
+        return self.shutdown is not None and self.shutdown.is_requested() and \
+            self.shutdown.remaining_budget_secs() <= 0
+
+    def shutdown_budget_exceeded(self, sleep_secs):
+        return self.shutdown is not None and self.shutdown.is_requested() and \
+            self.shutdown.remaining_budget_secs() < sleep_secs
@@ -0,0 +1,56 @@
+class SessionStats:
+    """
+    Tracks reuse of the long-lived reddit session: oauth token refreshes and http connection reuse,
+    read from praw/prawcore internals (missing internals are treated as zero rather than failing a sweep).
+    """
+
+    def __init__(self):
+        self.client_rebuilds = 0
+        self.token_refreshes = 0
+        self.last_access_token = None
+        # totals from clients which have since been rebuilt
+        self.retired_requests = 0
+        self.retired_connections = 0
+        self.current_requests = 0
+        self.current_connections = 0
+
+    @staticmethod
+    def connection_pools(reddit):
+        http = getattr(getattr(getattr(reddit, "_core", None), "_requestor", None), "_http", None)
+        if http is None:
+            return []
+        pools = list()
+        for adapter in http.adapters.values():
+            pool_manager = getattr(adapter, "poolmanager", None)
+            container = getattr(getattr(pool_manager, "pools", None), "_container", None)
+            if container:
+                pools.extend(container.values())
+        return pools
+
+    def update(self, reddit):
+        authorizer = getattr(getattr(reddit, "_core", None), "_authorizer", None)
+        access_token = getattr(authorizer, "access_token", None)
+        if access_token and access_token != self.last_access_token:
+            # the first token of each client is an acquisition, not a refresh
+            if self.last_access_token is not None:
+                self.token_refreshes += 1
+            self.last_access_token = access_token
+
+        pools = self.connection_pools(reddit)
+        self.current_requests = sum(getattr(pool, "num_requests", 0) for pool in pools)
+        self.current_connections = sum(getattr(pool, "num_connections", 0) for pool in pools)
+
+    def client_rebuilt(self):
+        self.client_rebuilds += 1
+        self.last_access_token = None
+        self.retired_requests += self.current_requests
+        self.retired_connections += self.current_connections
+        self.current_requests = 0
+        self.current_connections = 0
+
+    def __str__(self):
+        requests = self.retired_requests + self.current_requests
+        connections = self.retired_connections + self.current_connections
+        return f"Session: {requests} http requests over {connections} connections " \
+               f"({max(0, requests - connections)} reused), {self.token_refreshes} token refreshes, " \
+               f"{self.client_rebuilds} client rebuilds"
@@ -1,4 +1,9 @@
+import json
+import os
 import re
+import traceback
+
+from lazy_fetch_audit import LazyFetchAudit
 
 
 class Settings:
@@ -6,6 +11,31 @@ class Settings:
     # set to True to prevent any bot actions (report, remove, comments)
     is_dry_run = False
     post_check_frequency_mins = 5
+    # time allowed to finish in-flight reddit actions after SIGINT/SIGTERM, must be below fly.toml kill_timeout
+    shutdown_drain_budget_secs = 4
+    # consecutive failures before a subreddit is skipped for component_reset_timeout_mins and its subreddit rebuilt
+    component_failure_threshold = 3
+    component_reset_timeout_mins = 15
+    # consecutive sweeps where every subreddit failed before the reddit client itself is rebuilt
+    client_failure_threshold = 3
+    # maintenance actions (stale reports, cleanups) are deferred behind time critical actions, at most
+    # maintenance_actions_per_flush run after every subreddit is checked. Once waiting over maintenance_max_wait_mins,
+    # maintenance_starved_actions_per_call also run ahead of each time critical action chain
+    maintenance_actions_per_flush = 10
+    maintenance_max_wait_mins = 15
+    maintenance_starved_actions_per_call = 1
+    # per subreddit cache of submissions/comments shared by the handlers, refreshed in place by listings
+    object_cache_ttl_mins = 10
+    object_cache_max_entries = 2000
+    object_cache_max_bytes = 16 * 1024 * 1024
+    # fetch new/unmoderated for all subreddits as one "a+b+c" listing, paged until every subreddit is covered,
+    # at most combined_listing_limit posts and never more pages than separate listings would need
+    combined_listings = True
+    combined_listing_limit = 1000
+    # subreddits the combined listing couldn't cover use their own listing for this long before retrying
+    combined_listing_retry_mins = 60
+    # the unmoderated listing is only checked every stale_post_check_frequency_mins, so retry after a few checks
+    combined_unmoderated_retry_mins = 180
 
     report_submission_statement_insufficient_length = False
     report_stale_unmoderated_posts = True
@@ -72,6 +102,47 @@ class Settings:
         # Add more entries for other flair types
     }
 
+    # bot-wide settings, which can't be overridden per subreddit from the wiki/override file
+    global_settings = ("is_dry_run", "post_check_frequency_mins", "shutdown_drain_budget_secs",
+                       "component_failure_threshold", "component_reset_timeout_mins", "client_failure_threshold",
+                       "maintenance_actions_per_flush", "maintenance_max_wait_mins",
+                       "maintenance_starved_actions_per_call",
+                       "object_cache_ttl_mins", "object_cache_max_entries", "object_cache_max_bytes",
+                       "combined_listings", "combined_listing_limit", "combined_listing_retry_mins",
+                       "combined_unmoderated_retry_mins")
+
+    def __init__(self, overrides=None):
+        if overrides:
+            self.apply_overrides(overrides)
+        self.refresh_derived()
+
+    def apply_overrides(self, overrides):
+        for name, value in overrides.items():
+            if name in self.global_settings or name.startswith("_") or not hasattr(type(self), name):
+                raise ValueError(f"Unknown or non-overridable setting: {name}")
+            default = getattr(type(self), name)
+            if callable(default):
+                raise ValueError(f"Unknown or non-overridable setting: {name}")
+            # allow ints for floats, but don't allow bools (which are ints) for numbers or vice versa
+            numeric = (int, float)
+            same_type = type(value) is type(default) or \
+                (type(value) in numeric and type(default) in numeric)
+            if not same_type:
+                raise ValueError(f"Setting {name} must be {type(default).__name__}, got {type(value).__name__}")
+            setattr(self, name, value)
+
+    def refresh_derived(self):
+        # lookups derived from the settings, rebuilt once per settings instance rather than per post
+        self.low_effort_flair_set = frozenset(flair.lower() for flair in self.low_effort_flair)
+        self.excluded_flair_set = frozenset(flair.lower() for flair in self.excluded_flairs)
+        keywords = [re.escape(keyword.lower()) for keyword in self.submission_statement_on_topic_keywords]
+        self.on_topic_keyword_pattern = re.compile("|".join(keywords)) if keywords else None
+
+    def contains_on_topic_keyword(self, text):
+        if self.on_topic_keyword_pattern is None:
+            return False
+        return self.on_topic_keyword_pattern.search(text.lower()) is not None
+
     def flair_pin_text(self, flair):
         return self.submission_statement_flair_prefixes.get(flair, "")
 
@@ -197,10 +268,113 @@ class SettingsFactory:
     }
 
     @staticmethod
-    def get_settings(subreddit_name):
+    def get_settings(subreddit_name, overrides=None):
         # ensure only contains valid characters
         if not re.match(r'^\w+$', subreddit_name):
             raise ValueError("subreddit_name contains invalid characters")
 
         settings_class = SettingsFactory.settings_classes.get(subreddit_name.lower(), Settings)
-        return settings_class()
+        return settings_class(overrides)
+
+
+def parse_settings_overrides(content):
+    # json object of setting name -> value, optionally inside a markdown code block
+    lines = [line for line in content.splitlines() if not line.strip().startswith("```")]
+    text = "\n".join(lines).strip()
+    if not text:
+        return dict()
+    overrides = json.loads(text)
+    if not isinstance(overrides, dict):
+        raise ValueError("Settings overrides must be a json object")
+    return overrides
+
+
+class WikiSettingsSource:
+    def __init__(self, subreddit, page_name):
+        self.subreddit = subreddit
+        self.page_name = page_name
+
+    def __str__(self):
+        return f"wiki page r/{self.subreddit.display_name}/wiki/{self.page_name}"
+
+    def rebind(self, subreddit):
+        self.subreddit = subreddit
+
+    def fetch_revision(self):
+        # revision listing is much lighter than fetching the whole page
+        for revision in self.subreddit.wiki[self.page_name].revisions(limit=1):
+            return revision["id"]
+        return None
+
+    def fetch_content(self):
+        with LazyFetchAudit.expected():
+            return self.subreddit.wiki[self.page_name].content_md
+
+
+class FileSettingsSource:
+    def __init__(self, path):
+        self.path = path
+
+    def __str__(self):
+        return f"file {self.path}"
+
+    def rebind(self, subreddit):
+        pass
+
+    def fetch_revision(self):
+        if not os.path.exists(self.path):
+            return None
+        stat = os.stat(self.path)
+        return f"{stat.st_mtime_ns}-{stat.st_size}"
+
+    def fetch_content(self):
+        with open(self.path) as overrides_file:
+            return overrides_file.read()
+
+
+class SettingsReloader:
+    """
+    Layers subreddit settings overrides from a source (wiki page or local file) on top of the settings class.
+    The source is only re-read when its revision changes, and the new settings are swapped onto the tracker
+    as a whole, between sweeps.
+    """
+
+    def __init__(self, subreddit_name, source, discord_client):
+        self.subreddit_name = subreddit_name
+        self.source = source
+        self.discord_client = discord_client
+        self.revision = None
+        # the last revision fetch error, so a persistent failure (e.g. wiki unreachable) is reported once
+        self.revision_error = None
+
+    def reload_if_changed(self, subreddit_tracker):
+        try:
+            revision = self.source.fetch_revision()
+        except Exception as e:
+            error = (type(e).__name__, str(e))
+            if error != self.revision_error:
+                self.revision_error = error
+                self.report_error(e)
+            return
+        if self.revision_error is not None:
+            print(f"Fetching settings revision for {self.subreddit_name} from {self.source} recovered")
+            self.revision_error = None
+        if revision == self.revision:
+            return
+        # remember the revision even if it's invalid, so a broken revision is only reported once
+        self.revision = revision
+        try:
+            overrides = parse_settings_overrides(self.source.fetch_content()) if revision is not None else dict()
+            settings = SettingsFactory.get_settings(self.subreddit_name, overrides)
+        except Exception as e:
+            self.report_error(e)
+            return
+        print(f"Loaded settings for {self.subreddit_name} from {self.source} revision {revision}: "
+              f"{sorted(overrides.keys())}")
+        subreddit_tracker.settings = settings
+
+    def report_error(self, e):
+        message = f"Exception reloading settings for {self.subreddit_name} from {self.source}, " \
+                  f"keeping current settings: {e}\n```{traceback.format_exc()}```"
+        self.discord_client.send_error_msg(message)
+        print(message)
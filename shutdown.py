@@ -0,0 +1,36 @@
+import signal
+import threading
+import time
+
+
+class ShutdownCoordinator:
+    def __init__(self, drain_budget_secs):
+        self.drain_budget_secs = drain_budget_secs
+        self.requested_time = None
+        self.event = threading.Event()
+
+    def install_signal_handlers(self):
+        # fly sends SIGINT on deploy, SIGTERM covers docker stop/local use
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(sig, self.handle_signal)
+
+    def handle_signal(self, signum, frame):
+        if self.is_requested():
+            print(f"Received {signal.Signals(signum).name} again, still draining")
+            return
+        print(f"Received {signal.Signals(signum).name}, draining in-flight actions "
+              f"(budget: {self.drain_budget_secs}s)")
+        self.requested_time = time.time()
+        self.event.set()
+
+    def is_requested(self):
+        return self.event.is_set()
+
+    def remaining_budget_secs(self):
+        if not self.is_requested():
+            return None
+        return max(0.0, self.drain_budget_secs - (time.time() - self.requested_time))
+
+    def wait(self, timeout_secs):
+        # interruptible replacement for time.sleep between sweeps
+        return self.event.wait(timeout_secs)
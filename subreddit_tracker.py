@@ -1,10 +1,51 @@
+import calendar
 from datetime import datetime
 
+from circuit_breaker import CircuitBreaker
+from object_cache import ObjectCache
+from settings import Settings
+
 
 class SubredditTracker:
-    def __init__(self, subreddit, settings):
+    def __init__(self, subreddit, settings, settings_reloader=None):
         self.subreddit = subreddit
         self.subreddit_name = subreddit.display_name
         self.time_unmoderated_last_checked = datetime.utcfromtimestamp(0)
         self.monitored_ss_replies = list()
         self.settings = settings
+        self.settings_reloader = settings_reloader
+        self.combined_listing_retry_time = datetime.utcfromtimestamp(0)
+        self.combined_unmoderated_retry_time = datetime.utcfromtimestamp(0)
+        self.breaker = CircuitBreaker(self.subreddit_name, Settings.component_failure_threshold,
+                                      Settings.component_reset_timeout_mins * 60)
+        self.cache = ObjectCache(Settings.object_cache_ttl_mins * 60, Settings.object_cache_max_entries,
+                                 Settings.object_cache_max_bytes)
+
+    def rebind(self, subreddit):
+        # swap in a rebuilt subreddit (e.g. new reddit client), keeping all monitoring state
+        self.subreddit = subreddit
+        if self.settings_reloader:
+            self.settings_reloader.source.rebind(subreddit)
+        # cached objects are bound to the old client
+        self.cache.clear()
+
+    def reset_cached_state(self):
+        # drop anything cached which may be what keeps failing, keeping all monitoring state:
+        # cached reddit objects, and the settings revision so settings are re-read on the next sweep
+        self.cache.clear()
+        if self.settings_reloader:
+            self.settings_reloader.revision = None
+
+    def reload_settings(self):
+        if self.settings_reloader:
+            self.settings_reloader.reload_if_changed(self)
+
+    def checkpoint(self):
+        return {
+            "time_unmoderated_last_checked": calendar.timegm(self.time_unmoderated_last_checked.utctimetuple()),
+            "monitored_ss_replies": list(self.monitored_ss_replies),
+        }
+
+    def restore(self, state):
+        self.time_unmoderated_last_checked = datetime.utcfromtimestamp(state["time_unmoderated_last_checked"])
+        self.monitored_ss_replies = list(state["monitored_ss_replies"])
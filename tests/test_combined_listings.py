@@ -0,0 +1,156 @@
+import time
+from datetime import datetime
+from types import SimpleNamespace
+
+from janitor import Janitor
+from settings import SettingsFactory
+from subreddit_tracker import SubredditTracker
+
+PAGE_SIZE = 100
+
+
+class StubSubmission:
+    def __init__(self, subreddit_name, post_id, age_hours):
+        self.subreddit = SimpleNamespace(display_name=subreddit_name)
+        self.id = post_id
+        self.created_utc = time.time() - age_hours * 60 * 60
+
+    @property
+    def fullname(self):
+        return f"t3_{self.id}"
+
+
+class StubListings:
+    """Counts listing requests like praw would: one per page of up to 100 items actually iterated."""
+
+    def __init__(self, posts_by_subreddit, approved=(), unmoderated_by_subreddit=None):
+        self.posts_by_subreddit = posts_by_subreddit
+        self.unmoderated_by_subreddit = unmoderated_by_subreddit or dict()
+        # just approved posts, listed in new ahead of newer posts however old they are
+        self.approved = list(approved)
+        self.requests = 0
+
+    def listing(self, posts, limit):
+        for i, post in enumerate(posts[:limit]):
+            if i % PAGE_SIZE == 0:
+                self.requests += 1
+            yield post
+
+    def subreddit(self, name):
+        names = name.split("+")
+        posts = sorted((post for subreddit_name in names for post in self.posts_by_subreddit[subreddit_name]),
+                       key=lambda post: post.created_utc, reverse=True)
+        posts = [post for post in self.approved if post.subreddit.display_name in names] + posts
+        unmoderated = sorted((post for subreddit_name in names
+                              for post in self.unmoderated_by_subreddit.get(subreddit_name, ())),
+                             key=lambda post: post.created_utc, reverse=True)
+        return SimpleNamespace(display_name=name,
+                               new=lambda limit=PAGE_SIZE: self.listing(posts, limit),
+                               mod=SimpleNamespace(unmoderated=lambda limit=PAGE_SIZE: self.listing(unmoderated, limit)))
+
+
+def quiet_posts(subreddit_name):
+    # a post every 50 hours, so the 200 hour window holds only 4
+    return [StubSubmission(subreddit_name, f"{subreddit_name}{i}", i * 50 + 1) for i in range(12)]
+
+
+def busy_posts(subreddit_name):
+    # a post every 30 minutes, so a single page doesn't cover the 200 hour window
+    return [StubSubmission(subreddit_name, f"{subreddit_name}{i}", i * 0.5) for i in range(600)]
+
+
+def make_trackers(listings, subreddit_names):
+    return [SubredditTracker(listings.subreddit(name), SettingsFactory.get_settings(name))
+            for name in subreddit_names]
+
+
+def sweep_requests(listings, trackers):
+    # mirrors bot.py: subreddits which couldn't be covered recently use their own listing
+    janitor = Janitor(None, "bot", listings, None)
+    listings.requests = 0
+    now = datetime.utcnow()
+    combined_trackers = [tracker for tracker in trackers if tracker.combined_listing_retry_time <= now]
+    new_posts = janitor.fetch_combined_new_posts(combined_trackers) if len(combined_trackers) > 1 else dict()
+    for tracker in trackers:
+        if tracker.subreddit_name not in new_posts:
+            janitor.fetch_new_posts(tracker.settings, tracker.subreddit, tracker.cache)
+    return listings.requests, new_posts
+
+
+def unmoderated_sweep_requests(listings, trackers):
+    # mirrors bot.py for a due stale unmoderated check
+    janitor = Janitor(None, "bot", listings, None)
+    listings.requests = 0
+    now = datetime.utcnow()
+    combined_trackers = [tracker for tracker in trackers if tracker.combined_unmoderated_retry_time <= now]
+    stale = janitor.fetch_combined_stale_unmoderated_posts(combined_trackers) if len(combined_trackers) > 1 \
+        else dict()
+    for tracker in trackers:
+        if tracker.subreddit_name not in stale:
+            janitor.fetch_stale_unmoderated_posts(tracker.settings, tracker.subreddit.mod, tracker.cache)
+    return listings.requests, stale
+
+
+def test_combined_listing_requests_stay_flat_as_subreddits_grow():
+    for count in (2, 5, 10, 20):
+        names = [f"quiet{i}" for i in range(count)]
+        listings = StubListings({name: quiet_posts(name) for name in names})
+        requests, new_posts = sweep_requests(listings, make_trackers(listings, names))
+        assert requests == 1
+        assert sorted(new_posts) == sorted(names)
+
+
+def test_combined_listing_routes_each_subreddits_window_to_it():
+    listings = StubListings({"quiet0": quiet_posts("quiet0"), "quiet1": quiet_posts("quiet1")})
+    requests, new_posts = sweep_requests(listings, make_trackers(listings, ["quiet0", "quiet1"]))
+    for name, posts in new_posts.items():
+        post_ids = [post.submission.id for post in posts]
+        assert all(post.submission.subreddit.display_name == name for post in posts)
+        # the 4 posts within 200 hours
+        assert post_ids[:4] == [f"{name}{i}" for i in range(4)]
+
+
+def test_busy_subreddits_never_cost_more_than_separate_listings():
+    names = ["busy0", "busy1", "quiet0", "quiet1"]
+    listings = StubListings({"busy0": busy_posts("busy0"), "busy1": busy_posts("busy1"),
+                             "quiet0": quiet_posts("quiet0"), "quiet1": quiet_posts("quiet1")})
+    trackers = make_trackers(listings, names)
+
+    # the first sweep learns which subreddits the combined listing can't cover, at most one extra request
+    requests, new_posts = sweep_requests(listings, trackers)
+    assert requests <= len(names) + 1
+    for sweep in range(3):
+        requests, new_posts = sweep_requests(listings, trackers)
+        assert requests <= len(names)
+
+
+def test_old_approved_post_doesnt_end_other_subreddits_listing():
+    # an old, just approved post at the top of new, then fresh posts in every subreddit, all within one page
+    approved = StubSubmission("a", "approved", 300)
+    posts = {name: [StubSubmission(name, f"{name}{i}", i * 0.1) for i in range(40)] for name in ("a", "b")}
+    listings = StubListings(posts, approved=[approved])
+    trackers = make_trackers(listings, ["a", "b"])
+    separate = Janitor(None, "bot", listings, None).fetch_new_posts(trackers[0].settings, trackers[0].subreddit)
+
+    requests, new_posts = sweep_requests(listings, trackers)
+    assert [post.submission.id for post in new_posts["a"]] == [post.submission.id for post in separate]
+    assert requests == 1
+    assert len(new_posts["a"]) == 41
+    assert len(new_posts["b"]) == 40
+
+
+def test_busy_unmoderated_subreddits_back_off_from_the_combined_listing():
+    names = ["busy0", "busy1", "quiet0", "quiet1"]
+    listings = StubListings({name: list() for name in names},
+                            unmoderated_by_subreddit={"busy0": busy_posts("busy0"), "busy1": busy_posts("busy1"),
+                                                      "quiet0": quiet_posts("quiet0"),
+                                                      "quiet1": quiet_posts("quiet1")})
+    trackers = make_trackers(listings, names)
+
+    # the first check learns which subreddits the combined listing can't cover, at most one extra request
+    requests, stale = unmoderated_sweep_requests(listings, trackers)
+    assert requests <= len(names) + 1
+    # later checks don't pay for the truncated combined pages again
+    for check in range(3):
+        requests, stale = unmoderated_sweep_requests(listings, trackers)
+        assert requests <= len(names)
@@ -0,0 +1,215 @@
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from action_lane import ActionLane
+from janitor import Janitor
+from lazy_fetch_audit import LazyFetchAudit, UnexpectedLazyFetch
+from post import Post
+from settings import SettingsFactory
+from subreddit_tracker import SubredditTracker
+
+
+class StubLazySubmission:
+    """Fetches on access to a missing attribute like praw's lazy objects, counting the fetches."""
+
+    def __init__(self, **data):
+        self.fetches = 0
+        self.__dict__.update(data)
+
+    def __getattr__(self, attribute):
+        if attribute.startswith("__") or attribute == "fetches":
+            raise AttributeError(attribute)
+        self._fetch()
+        if attribute not in self.__dict__:
+            raise AttributeError(attribute)
+        return self.__dict__[attribute]
+
+    def _fetch(self):
+        self.fetches += 1
+        self.__dict__["author"] = "someone"
+
+    def __str__(self):
+        return "t3_stub"
+
+
+StubLazySubmission._fetch = LazyFetchAudit.wrap_fetch(StubLazySubmission._fetch, "StubLazySubmission")
+
+
+@pytest.fixture
+def strict_audit():
+    LazyFetchAudit.strict = True
+    yield
+    LazyFetchAudit.strict = False
+    LazyFetchAudit.report_and_reset()
+
+
+def listed_submission(**data):
+    # the fields a listing returns for a plain link post, without crosspost_parent
+    return StubLazySubmission(created_utc=time.time(), is_self=False, url="https://example.com/article", **data)
+
+
+def test_is_crosspost_makes_no_fetch_in_strict_mode(strict_audit):
+    submission = listed_submission()
+    assert not Post(submission).is_crosspost()
+    assert Post(listed_submission(crosspost_parent="t3_parent")).is_crosspost()
+    assert submission.fetches == 0
+    assert not LazyFetchAudit.unexpected_fetches
+
+
+def test_unexpected_fetch_raises_in_strict_mode(strict_audit):
+    submission = listed_submission()
+    # hasattr on a missing attribute is a hidden full fetch
+    with pytest.raises(UnexpectedLazyFetch):
+        hasattr(submission, "crosspost_parent")
+
+
+def test_fetch_now_is_expected_in_strict_mode(strict_audit):
+    submission = LazyFetchAudit.fetch_now(listed_submission(), "author")
+    assert submission.author == "someone"
+    assert submission.fetches == 1
+    assert sum(LazyFetchAudit.lazy_fetches.values()) == 1
+    assert not LazyFetchAudit.unexpected_fetches
+
+
+class StubReddit:
+    """Serves stub lazy objects from canned data, counting requests like praw would make them."""
+
+    def __init__(self, data, listing):
+        # fullname -> the data a full fetch returns
+        self.data = data
+        self.listing = listing
+        self.requests = 0
+
+    def comment(self, id):
+        return StubLazyModel(self, id=id, fullname=f"t1_{id}")
+
+    def subreddit(self, name):
+        def new(limit=100):
+            for i, post in enumerate(self.listing[:limit]):
+                if i % 100 == 0:
+                    self.requests += 1
+                yield post
+        return StubLazyModel(self, display_name=name, new=new)
+
+
+class StubLazyModel:
+    """
+    Like a praw model: holds the data it was built with, and accessing any other attribute fetches the rest
+    (one request), including a submission's comment forest.
+    """
+
+    def __init__(self, reddit, **data):
+        self.__dict__.update(data, _reddit=reddit, _fetched=False)
+
+    def __getattr__(self, attribute):
+        if attribute.startswith("_") or self._fetched:
+            raise AttributeError(attribute)
+        self._fetch()
+        return getattr(self, attribute)
+
+    def _fetch(self):
+        self._reddit.requests += 1
+        self.__dict__.update(self._reddit.data.get(self.fullname, dict()), _fetched=True)
+
+    def __eq__(self, other):
+        # praw models compare equal to their id
+        if isinstance(other, str):
+            return other == self.id
+        return self is other
+
+    def __hash__(self):
+        return hash(self.fullname)
+
+    def __str__(self):
+        return self.__dict__.get("name") or self.fullname
+
+
+StubLazyModel._fetch = LazyFetchAudit.wrap_fetch(StubLazyModel._fetch, "StubLazyModel")
+
+
+class RecordingActionsHandler:
+    def __init__(self):
+        self.actions = list()
+
+    def remove_content(self, content, external_removal_reason, internal_removal_reason, reply=True,
+                       lane=ActionLane.DEADLINE, on_removed=None):
+        self.actions.append(("remove", content.id))
+
+    def report_content(self, content, reason, lane=ActionLane.DEADLINE):
+        self.actions.append(("report", content.id))
+
+    def reply_to_content(self, content, reason, pin=True, lock=False, ignore_reports=False,
+                         lane=ActionLane.DEADLINE):
+        self.actions.append(("reply", content.id))
+        return SimpleNamespace(id="onreply")
+
+    def edit_content(self, content, body, lane=ActionLane.ON_TOPIC):
+        self.actions.append(("edit", content.id))
+
+
+def make_sweep_reddit():
+    now = time.time()
+    bot = StubLazyModel(None, name="bot", fullname="t2_bot")
+    op = StubLazyModel(None, name="op", fullname="t2_op")
+    ss_text = "This is what the linked article says, and why it matters to this subreddit. " * 3
+
+    def comment(comment_id, post_id, author, body, **data):
+        data = dict(dict(is_submitter=author is op, removed=False, replies=list(), score=1, created_utc=now,
+                         permalink=f"/r/test/comments/{post_id}/title/{comment_id}/"), **data)
+        return StubLazyModel(reddit, id=comment_id, fullname=f"t1_{comment_id}", link_id=f"t3_{post_id}",
+                             author=author, body=body, **data)
+
+    def submission(post_id, age_mins, comments):
+        listed = StubLazyModel(reddit, id=post_id, fullname=f"t3_{post_id}", title=post_id,
+                               permalink=f"/r/test/comments/{post_id}/title/", url="https://example.com/article",
+                               is_self=False, selftext="", link_flair_text=None, approved=False, removed=False,
+                               author=op, created_utc=now - age_mins * 60)
+        data[listed.fullname] = dict(comments=comments)
+        return listed
+
+    data = dict()
+    reddit = StubReddit(data, list())
+    # the bot's pinned copy of an ss which has since been edited: edit support
+    edited_ss = comment("ss1", "edited", op, ss_text + "Edited.")
+    pinned = comment("pin1", "edited", bot, f"The following submission statement was provided by /u/op:\n\n"
+                                           f"---\n\n{ss_text}\n\n---\n\n Please reply to OP's comment here: "
+                                           f"https://old.reddit.com/r/test/comments/edited/title/ss1/")
+    # a new post with an off topic ss: on topic reply
+    off_topic_ss = comment("ss2", "new", op, ss_text)
+    # an expired post without an ss, and an old bot comment: removal and cleanup
+    old_bot_comment = comment("old1", "missing", bot, "An old reminder")
+    reddit.listing.extend([submission("edited", 60, [pinned, edited_ss]),
+                           submission("new", 10, [off_topic_ss]),
+                           submission("missing", 60, [old_bot_comment])])
+    # monitored on topic replies, refetched for their score: one downvoted, one just posted
+    data["t1_downvoted"] = comment("downvoted", "new", bot, "on topic?", score=-60000).__dict__
+    data["t1_onreply"] = comment("onreply", "new", bot, "on topic?").__dict__
+    return reddit
+
+
+def test_sweep_makes_only_expected_fetches_in_strict_mode(strict_audit):
+    reddit = make_sweep_reddit()
+    overrides = {"submission_statement_edit_support": True, "submission_statement_on_topic_reminder": True,
+                 "submission_statement_on_topic_keywords": ["ufo"],
+                 "submission_statement_on_topic_response": "ufos",
+                 "submission_statement_on_topic_check_downvotes": True}
+    tracker = SubredditTracker(reddit.subreddit("test"), SettingsFactory.get_settings("test", overrides))
+    tracker.monitored_ss_replies.append("downvoted")
+    discord_client = SimpleNamespace(errors=list())
+    discord_client.send_error_msg = discord_client.errors.append
+    handler = RecordingActionsHandler()
+    janitor = Janitor(discord_client, "bot", reddit, handler)
+
+    janitor.handle_posts(tracker)
+    janitor.handle_monitored_ss_replies(tracker)
+
+    # strict mode errors are caught per post, and would be reported
+    assert discord_client.errors == list()
+    assert handler.actions == [("edit", "pin1"), ("reply", "ss2"), ("remove", "old1"), ("remove", "missing"),
+                               ("remove", "downvoted")]
+    # one listing, a comment forest per post, and a refetch per monitored reply; their posts are cached
+    assert reddit.requests == 1 + 3 + 2
+    assert sum(LazyFetchAudit.lazy_fetches.values()) == 3 + 2
+    assert not LazyFetchAudit.unexpected_fetches
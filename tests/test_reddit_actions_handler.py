@@ -0,0 +1,114 @@
+import signal
+import threading
+import time
+from collections import deque
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip("praw")
+
+import reddit_actions_handler
+from action_journal import ActionJournal
+from action_lane import ActionLane
+from reddit_actions_handler import RedditActionsHandler
+from settings import Settings
+from shutdown import ShutdownCoordinator
+
+
+class StubContent:
+    """Records each reddit call made on it, in order, into calls."""
+
+    def __init__(self, name, calls):
+        self.name = name
+        self.calls = calls
+        self.id = name
+        self.fullname = f"t3_{name}"
+        self.author = "someone"
+        self.removed = False
+        self.fail_reply = False
+        self.mod = SimpleNamespace(remove=lambda mod_note: self.record_removal(),
+                                   distinguish=lambda sticky: calls.append(f"distinguish {name}"),
+                                   lock=lambda: calls.append(f"lock {name}"),
+                                   ignore_reports=lambda: calls.append(f"ignore_reports {name}"))
+
+    def record_removal(self):
+        self.calls.append(f"remove {self.name}")
+        self.removed = True
+
+    def report(self, reason):
+        self.calls.append(f"report {self.name}")
+
+    def reply(self, body):
+        if self.fail_reply:
+            raise KeyboardInterrupt("deployed")
+        self.calls.append(f"reply to {self.name}")
+        return StubContent(f"r{self.name}", self.calls)
+
+    def __str__(self):
+        return self.name
+
+
+@pytest.fixture
+def handler(monkeypatch):
+    monkeypatch.setattr(reddit_actions_handler.time, "sleep", lambda secs: None)
+    return RedditActionsHandler(None, None)
+
+
+def test_starved_maintenance_only_runs_before_a_chains_first_call(handler):
+    calls = list()
+    for name in ("stale1", "stale2"):
+        content = StubContent(name, calls)
+        handler.report_content(content, "stale", lane=ActionLane.MAINTENANCE)
+    # both have waited past maintenance_max_wait_mins
+    starved_time = time.time() - Settings.maintenance_max_wait_mins * 60 - 1
+    handler.deferred_actions = deque((starved_time,) + queued[1:] for queued in handler.deferred_actions)
+
+    handler.remove_content(StubContent("post", calls), "reason", "internal")
+    assert calls == ["report stale1", "remove post", "reply to post", "distinguish rpost"]
+
+    handler.reply_to_content(StubContent("post2", calls), "reason", lock=True)
+    assert calls[4:] == ["report stale2", "reply to post2", "distinguish rpost2", "lock rpost2"]
+
+
+def test_removal_interrupted_before_its_reply_is_replied_to_on_startup(monkeypatch, tmp_path):
+    monkeypatch.setattr(reddit_actions_handler.time, "sleep", lambda secs: None)
+    calls = list()
+    post = StubContent("post", calls)
+    post.fail_reply = True
+    journal = ActionJournal(str(tmp_path / "action_journal.json"))
+    with pytest.raises(KeyboardInterrupt):
+        RedditActionsHandler(None, None, journal).remove_content(post, "reason", "internal")
+    assert calls == ["remove post"]
+
+    # next startup
+    post.fail_reply = False
+    reddit = SimpleNamespace(submission=lambda id: post)
+    journal = ActionJournal(str(tmp_path / "action_journal.json"))
+    RedditActionsHandler(reddit, None, journal).resume_journaled_actions()
+    assert calls == ["remove post", "reply to post", "distinguish rpost"]
+    assert journal.pending() == dict()
+
+
+def test_shutdown_cuts_an_in_progress_throttle_short():
+    calls = list()
+    shutdown = ShutdownCoordinator(drain_budget_secs=0.2)
+    handler = RedditActionsHandler(None, None, shutdown=shutdown)
+    handler.last_call_time = time.time()
+    threading.Timer(0.1, shutdown.handle_signal, (signal.SIGINT, None)).start()
+
+    start_time = time.time()
+    handler.report_content(StubContent("post", calls), "reason")
+    assert calls == ["report post"]
+    assert time.time() - start_time < 1
+
+
+def test_no_new_chain_starts_once_the_drain_budget_is_spent():
+    calls = list()
+    shutdown = ShutdownCoordinator(drain_budget_secs=0)
+    shutdown.handle_signal(signal.SIGINT, None)
+    handler = RedditActionsHandler(None, None, shutdown=shutdown)
+
+    handler.remove_content(StubContent("post", calls), "reason", "internal")
+    assert handler.reply_to_content(StubContent("post2", calls), "reason") is None
+    assert calls == list()
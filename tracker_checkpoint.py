@@ -0,0 +1,28 @@
+import json
+import os
+
+
+class TrackerCheckpoint:
+    def __init__(self, path):
+        self.path = path
+
+    def save(self, subreddit_trackers):
+        state = {tracker.subreddit_name.lower(): tracker.checkpoint() for tracker in subreddit_trackers}
+        temp_path = self.path + ".tmp"
+        with open(temp_path, "w") as checkpoint_file:
+            json.dump(state, checkpoint_file)
+        os.replace(temp_path, self.path)
+
+    def restore(self, subreddit_tracker):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path) as checkpoint_file:
+                state = json.load(checkpoint_file)
+            tracker_state = state.get(subreddit_tracker.subreddit_name.lower())
+            if tracker_state:
+                subreddit_tracker.restore(tracker_state)
+                print(f"Restored {subreddit_tracker.subreddit_name} from checkpoint: "
+                      f"{len(subreddit_tracker.monitored_ss_replies)} monitored ss replies")
+        except (OSError, ValueError, KeyError) as e:
+            print(f"Could not restore {subreddit_tracker.subreddit_name} from checkpoint {self.path}: {e}")